@@ -1,38 +1,394 @@
 # app.py (updated - adds stable user_ref and booking_ref generation)
-from flask import Flask, request, jsonify, abort
+from flask import Flask, request, jsonify, abort, has_request_context
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
+from qr_tickets import InvalidTicket, load_keys_from_env, sign_ticket, ticket_claims, verify_ticket
+from traffic_capture import SKIP_ENVIRON_KEY, install_capture
 import random
 import datetime
 from datetime import timedelta, date
 import uuid
+import base64
+import bisect
+import csv
+import io
 import json
+from decimal import Decimal, InvalidOperation
+from collections import OrderedDict
 import os
+import click
 import time
+import math
+import threading
+import functools
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Ticket signing keys (see qr_tickets.py for the token format and rotation). Empty when
+# QR_SIGNING_KEYS is unset: no tickets are issued, verified or accepted at check-in.
+qr_keys, qr_active_kid = load_keys_from_env()
+
 # ---------- DATABASE CONNECTION & SETUP ----------
-def get_db_connection():
+DEFAULT_SHARD = "default"
+DEFAULT_TEMPLE_ID = "default"
+
+def load_shard_config():
+    """
+    TEMPLE_SHARDS (JSON) maps temples to databases, e.g.
+    {"shards": {"south": {"database": "dd_south"}, "north": {"host": "db2", "database": "dd_north"}},
+     "temples": {"tirupati": "south", "kedarnath": "north"}}
+    Shard entries override the DB_* settings. The "default" shard is always the DB_* database;
+    it holds users/OTPs and every temple that is not mapped elsewhere.
+    """
+    raw = os.environ.get("TEMPLE_SHARDS")
+    cfg = json.loads(raw) if raw else {}
+    shards = {DEFAULT_SHARD: {}}
+    shards.update(cfg.get("shards", {}))
+    temples = dict(cfg.get("temples", {}))
+    for temple, shard in temples.items():
+        if shard not in shards:
+            raise ValueError(f"TEMPLE_SHARDS: temple '{temple}' maps to unknown shard '{shard}'")
+    return shards, temples
+
+db_shards, temple_shards = load_shard_config()
+_db_pools = {}
+_db_pool_lock = threading.Lock()
+# Per-thread state: /batch shares one connection across sub-requests, CLI jobs pin a temple
+_db_local = threading.local()
+
+def current_temple_id():
+    """Temple for the active request: X-Temple-Id header, ?temple_id=, or temple_id in the JSON body."""
+    if has_request_context():
+        temple = request.headers.get("X-Temple-Id") or request.args.get("temple_id")
+        if not temple and request.is_json:
+            body = request.get_json(silent=True)
+            if isinstance(body, dict):
+                temple = body.get("temple_id")
+        if temple:
+            return str(temple)
+    return getattr(_db_local, "temple_id", None) or DEFAULT_TEMPLE_ID
+
+# Opt-in sampled, PII-scrubbed request capture for replay benchmarks (see traffic_capture.py)
+if os.environ.get("TRAFFIC_CAPTURE_FILE"):
+    install_capture(app, os.environ["TRAFFIC_CAPTURE_FILE"], float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE", 0.1)),
+                    temple_id=current_temple_id)
+
+def shard_for_temple(temple_id):
+    return temple_shards.get(temple_id, DEFAULT_SHARD)
+
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", 3))
+# Seconds a query, ping or commit may wait on the socket (0 = forever). Keep it above
+# DB_QUERY_TIMEOUT_MS so the server-side cap normally fires first.
+DB_READ_TIMEOUT = int(os.environ.get("DB_READ_TIMEOUT", 6))
+# read_timeout/write_timeout connection options exist from mysql-connector-python 9.2
+DB_SOCKET_TIMEOUTS_SUPPORTED = "read_timeout" in getattr(mysql.connector.constants, "DEFAULT_CONFIGURATION", {})
+if DB_READ_TIMEOUT > 0 and not DB_SOCKET_TIMEOUTS_SUPPORTED:
+    print("⚠️ mysql-connector-python < 9.2: DB_READ_TIMEOUT ignored, a stalled MySQL can block queries")
+
+def db_config(shard=DEFAULT_SHARD):
+    config = {
+        "host": os.environ.get("DB_HOST", "localhost"),
+        "user": os.environ.get("DB_USER", "root"),
+        "password": os.environ.get("DB_PASS", ""),
+        "database": os.environ.get("DB_NAME", "divya_drishti_db"),
+        "port": int(os.environ.get("DB_PORT", 3306)),
+        # Bounds the TCP connect and handshake only; the driver clears it once connected
+        "connection_timeout": DB_CONNECT_TIMEOUT,
+    }
+    if DB_READ_TIMEOUT > 0 and DB_SOCKET_TIMEOUTS_SUPPORTED:
+        # Bound every socket read/write after the handshake too (pool ping, queries, commits),
+        # so a server that accepts the connection and then stalls raises instead of hanging
+        config["read_timeout"] = DB_READ_TIMEOUT
+        config["write_timeout"] = DB_READ_TIMEOUT
+    config.update(db_shards.get(shard, {}))
+    return config
+
+# Server-side cap for SELECTs (MySQL max_execution_time); 0 disables it
+DB_QUERY_TIMEOUT_MS = int(os.environ.get("DB_QUERY_TIMEOUT_MS", 5000))
+
+def get_db_pool(shard=DEFAULT_SHARD):
+    """Lazily create one connection pool per shard (mysql-connector caps pools at 32)."""
+    pool = _db_pools.get(shard)
+    if pool is None:
+        with _db_pool_lock:
+            pool = _db_pools.get(shard)
+            if pool is None:
+                size = max(1, min(int(os.environ.get("DB_POOL_SIZE", 10)), 32))
+                pool = _db_pools[shard] = pooling.MySQLConnectionPool(
+                    pool_name=f"divya_drishti_{shard}",
+                    pool_size=size,
+                    pool_reset_session=True,
+                    autocommit=False,
+                    **db_config(shard)
+                )
+    return pool
+
+class CircuitBreaker:
+    """
+    Trips open after failure_threshold consecutive DB failures. While open, callers fail
+    fast instead of blocking on a dead socket. After reset_timeout seconds a single probe is
+    let through (half-open); its success closes the breaker, its failure re-opens it.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, trip=False):
+        """trip=True opens the breaker at once instead of counting towards failure_threshold."""
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if trip or self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"⚠️ Database circuit breaker OPEN after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def is_open(self):
+        with self._lock:
+            return self.state != "closed"
+
+    def would_allow(self):
+        """Like allow() but without claiming the half-open probe: False only while callers are being refused."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return not self._probe_in_flight
+
+def is_outage_error(e):
+    """
+    True for errors that mean the server is unreachable or stalled rather than that the
+    statement was wrong: client-side CR_* codes (2000-2999: lost connection, server gone
+    away, can't connect) and 3024, which covers both mysql-connector's read/write timeouts
+    and the server's max_execution_time kill. The pool wraps a failed reconnect in an
+    errno-less InterfaceError, so the chained cause is checked too.
+    """
+    while e is not None:
+        errno = getattr(e, "errno", None) or 0
+        if 2000 <= errno < 3000 or errno == 3024:
+            return True
+        e = e.__cause__
+    return False
+
+class BreakerConnection:
+    """
+    Proxy around a checked-out connection that reports outage errors raised by queries,
+    fetches and commits to the shard's breaker, so a MySQL that stalls after checkout trips
+    it the same way as one that refuses connections.
+    """
+    def __init__(self, conn, breaker):
+        self._conn = conn
+        self._breaker = breaker
+
+    def _call(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Error as e:
+            if is_outage_error(e):
+                self._breaker.record_failure()
+            raise
+
+    def cursor(self, *args, **kwargs):
+        return _BreakerCursor(self._call(self._conn.cursor, *args, **kwargs), self)
+
+    def commit(self):
+        return self._call(self._conn.commit)
+
+    def rollback(self):
+        return self._call(self._conn.rollback)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class _BreakerCursor:
+    _WRAPPED = {"execute", "executemany", "fetchone", "fetchall", "fetchmany", "callproc"}
+
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in self._WRAPPED:
+            return functools.partial(self._conn._call, attr)
+        return attr
+
+# One breaker per shard so an outage on one database does not fail the other temples
+db_breakers = {
+    shard: CircuitBreaker(
+        failure_threshold=int(os.environ.get("DB_BREAKER_FAILURES", 5)),
+        reset_timeout=float(os.environ.get("DB_BREAKER_RESET", 10))
+    )
+    for shard in db_shards
+}
+
+_db_checkout_gates = {shard: threading.Lock() for shard in db_shards}
+
+def get_db_connection(shard=None):
+    """Connection for the given shard, or for the current request's temple when shard is None."""
+    global DB_QUERY_TIMEOUT_MS
+    if shard is None:
+        shard = shard_for_temple(current_temple_id())
+    shared = getattr(_db_local, "shared_conn", None)
+    if shared is not None and shared.shard == shard:
+        if shared._conn is None:
+            # First sub-request of a batch that needs the DB; a failed checkout is retried by the next one
+            _db_local.shared_conn = None
+            try:
+                shared._conn = get_db_connection(shard)
+            finally:
+                _db_local.shared_conn = shared
+        return shared if shared._conn is not None else None
+    breaker = db_breakers[shard]
+    if not breaker.would_allow():
+        print(f"❌ Database connection skipped: circuit breaker open for shard '{shard}'")
+        return None
+    # mysql-connector pings and reconnects under one module-wide lock, so checkouts against a
+    # stalled server queue up behind each other; wait for our turn at most DB_CONNECT_TIMEOUT
+    gate = _db_checkout_gates[shard]
+    if not gate.acquire(timeout=DB_CONNECT_TIMEOUT):
+        print(f"❌ Database connection skipped: checkout on shard '{shard}' is stalled")
+        return None
+    if not breaker.allow():
+        gate.release()
+        print(f"❌ Database connection skipped: circuit breaker open for shard '{shard}'")
+        return None
+    conn = None
     try:
-        conn = mysql.connector.connect(
-            host=os.environ.get("DB_HOST", "localhost"),
-            user=os.environ.get("DB_USER", "root"),
-            password=os.environ.get("DB_PASS", ""),
-            database=os.environ.get("DB_NAME", "divya_drishti_db"),
-            autocommit=False
-        )
-        return conn
+        try:
+            try:
+                conn = get_db_pool(shard).get_connection()
+            except pooling.PoolError:
+                # Pool exhausted - fall back to a one-off connection rather than failing the request
+                conn = mysql.connector.connect(autocommit=False, **db_config(shard))
+        finally:
+            gate.release()
+        if DB_QUERY_TIMEOUT_MS > 0:
+            # Session vars are reset when a pooled connection is returned, so set it per checkout
+            cur = conn.cursor()
+            try:
+                cur.execute("SET SESSION max_execution_time=%s", (DB_QUERY_TIMEOUT_MS,))
+            except Error as e:
+                # 1193 = unknown system variable: server without max_execution_time (e.g. MariaDB)
+                if e.errno != 1193:
+                    raise
+                print(f"⚠️ Query timeout not supported by server, disabling: {e}")
+                DB_QUERY_TIMEOUT_MS = 0
+            finally:
+                cur.close()
+        breaker.record_success()
+        return BreakerConnection(conn, breaker)
     except Error as e:
+        # A checkout that timed out or lost the socket has already waited seconds: open at once
+        breaker.record_failure(trip=is_outage_error(e))
         print(f"❌ Database connection failed: {e}")
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
         return None
 
-def create_tables():
+class StaleCache:
+    """Last good JSON body per GET URL, kept up to max_age seconds for stale-if-error serving."""
+    def __init__(self, max_entries=2000, max_age=3600):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] <= self.max_age:
+                return entry[1], int(time.monotonic() - entry[0])
+            return None
+
+stale_cache = StaleCache(max_age=int(os.environ.get("STALE_IF_ERROR_MAX_AGE", 3600)))
+
+def stale_if_error(view):
+    """
+    For cacheable GET routes: remember the last 200 body per URL and serve it (marked stale)
+    while the breaker is refusing connections or when the handler fails with a 5xx. Once the
+    breaker's reset timeout has passed the handler runs, so cached URLs also send the
+    half-open probe and stop serving stale data as soon as MySQL is back.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        temple_id = current_temple_id()
+        key = f"{temple_id}|{request.full_path}"
+        stale = stale_cache.get(key)
+        if stale is not None and not db_breakers[shard_for_temple(temple_id)].would_allow():
+            return _stale_response(*stale)
+        resp = app.make_response(view(*args, **kwargs))
+        if resp.status_code == 200:
+            body = resp.get_data()
+            stale_cache.put(key, body)
+        elif resp.status_code >= 500 and stale is not None:
+            return _stale_response(*stale)
+        return resp
+    return wrapper
+
+def _stale_response(body, age):
+    resp = app.response_class(body, status=200, mimetype="application/json")
+    resp.headers["Warning"] = '110 - "Response is Stale"'
+    resp.headers["Age"] = str(age)
+    resp.headers["X-Cache"] = "STALE"
+    return resp
+
+class SharedConnection:
+    """Proxy handed to route handlers during a batch; close() is a no-op so the
+    connection survives until the whole batch is finished. The connection is checked out
+    by the first sub-request that needs one (see get_db_connection), not up front."""
+    def __init__(self, shard):
+        self._conn = None
+        self.shard = shard
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def create_tables(shard=DEFAULT_SHARD):
     """Create necessary tables if they don't exist. Adds user_ref and booking_ref columns."""
-    conn = get_db_connection()
+    conn = get_db_connection(shard)
     if not conn:
         print("❌ Cannot create tables - no database connection")
         return False
@@ -72,6 +428,7 @@ def create_tables():
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS bookings (
                 id INT AUTO_INCREMENT PRIMARY KEY,
+                temple_id VARCHAR(50) NOT NULL DEFAULT 'default',
                 booking_ref VARCHAR(50) UNIQUE NOT NULL,
                 title VARCHAR(255) NOT NULL,
                 booking_date DATE NOT NULL,
@@ -80,7 +437,8 @@ def create_tables():
                 amount INT NOT NULL DEFAULT 0,
                 paid BOOLEAN DEFAULT FALSE,
                 payment_ref VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expired_at DATETIME NULL
             )
         ''')
 
@@ -104,19 +462,34 @@ def create_tables():
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS notifications (
                 id INT AUTO_INCREMENT PRIMARY KEY,
+                temple_id VARCHAR(50) NOT NULL DEFAULT 'default',
                 title VARCHAR(255) NOT NULL,
                 message TEXT NOT NULL,
                 type VARCHAR(50) DEFAULT 'general',
                 booking_id INT NULL,
                 is_read BOOLEAN DEFAULT FALSE,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                recipient_id INT NULL,
                 FOREIGN KEY (booking_id) REFERENCES bookings(id) ON DELETE SET NULL
             )
         ''')
 
+        # Per-user read receipts for broadcast notifications (users.id is on the default shard)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notification_reads (
+                user_id INT NOT NULL,
+                notification_id INT NOT NULL,
+                read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, notification_id),
+                KEY idx_reads_notification (notification_id)
+            )
+        ''')
+
         # Index creation (wrap with try to avoid errors if index exists)
         try: cursor.execute('CREATE INDEX idx_users_phone ON users(phone)')
         except: pass
+        try: cursor.execute('CREATE INDEX idx_users_name_id ON users(name, id)')
+        except: pass
         try:
             cursor.execute('CREATE INDEX idx_otps_phone ON otps(phone)')
             cursor.execute('CREATE INDEX idx_otps_expires ON otps(expires_at)')
@@ -130,6 +503,105 @@ def create_tables():
             cursor.execute('CREATE INDEX idx_notifications_booking ON notifications(booking_id)')
             cursor.execute('CREATE INDEX idx_notifications_isread ON notifications(is_read)')
         except: pass
+        try: cursor.execute('CREATE INDEX idx_bookings_created ON bookings(created_at)')
+        except: pass
+        try: cursor.execute('CREATE INDEX idx_notifications_created ON notifications(created_at)')
+        except: pass
+
+        # Cold archive tables: same shape as the hot tables (LIKE copies indexes but not FKs)
+        cursor.execute('CREATE TABLE IF NOT EXISTS bookings_archive LIKE bookings')
+        cursor.execute('CREATE TABLE IF NOT EXISTS persons_archive LIKE persons')
+        cursor.execute('CREATE TABLE IF NOT EXISTS notifications_archive LIKE notifications')
+
+        # Precomputed crowd forecast, written nightly by `flask compute-forecast`
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS crowd_forecasts (
+                temple_id VARCHAR(50) NOT NULL DEFAULT 'default',
+                forecast_date DATE NOT NULL,
+                time_slot VARCHAR(100) NOT NULL,
+                expected_persons INT NOT NULL DEFAULT 0,
+                booked_persons INT NOT NULL DEFAULT 0,
+                baseline DECIMAL(10,2) NOT NULL DEFAULT 0,
+                computed_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (temple_id, forecast_date, time_slot)
+            )
+        ''')
+
+        # Gate check-ins, one row per booking per day
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS checkins (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                temple_id VARCHAR(50) NOT NULL DEFAULT 'default',
+                booking_id INT NOT NULL,
+                booking_ref VARCHAR(50) NOT NULL,
+                checkin_date DATE NOT NULL,
+                scanned_at DATETIME NOT NULL,
+                gate_id VARCHAR(50),
+                device_id VARCHAR(100),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                upload_id CHAR(32) NULL,
+                UNIQUE KEY uq_checkins_date_booking (checkin_date, booking_id),
+                KEY idx_checkins_upload (upload_id)
+            )
+        ''')
+
+        # Scratch rows for settlement-file reconciliation, keyed by run
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settlement_staging (
+                batch_id CHAR(32) NOT NULL,
+                row_no INT NOT NULL,
+                booking_ref VARCHAR(50),
+                payment_ref VARCHAR(255),
+                amount INT NOT NULL,
+                booking_id INT,
+                outcome VARCHAR(20),
+                PRIMARY KEY (batch_id, row_no),
+                KEY idx_staging_booking (batch_id, booking_id)
+            )
+        ''')
+
+        # Check-in upload ids, used to tell our inserts from rows another worker stored first
+        try: cursor.execute("ALTER TABLE checkins ADD COLUMN upload_id CHAR(32) NULL")
+        except: pass
+        try: cursor.execute('CREATE INDEX idx_checkins_upload ON checkins(upload_id)')
+        except: pass
+
+        # Notification recipients: NULL = admin feed, 0 = broadcast to the temple, >0 = users.id
+        for table in ("notifications", "notifications_archive"):
+            try: cursor.execute(f"ALTER TABLE {table} ADD COLUMN recipient_id INT NULL")
+            except: pass
+        try: cursor.execute('CREATE INDEX idx_notifications_feed ON notifications(temple_id, recipient_id, id)')
+        except: pass
+
+        # Unpaid-hold expiry: column for older databases plus the sweeper's scan index
+        for table in ("bookings", "bookings_archive"):
+            try: cursor.execute(f"ALTER TABLE {table} ADD COLUMN expired_at DATETIME NULL")
+            except: pass
+        try: cursor.execute('CREATE INDEX idx_bookings_unpaid_hold ON bookings(paid, expired_at, created_at)')
+        except: pass
+
+        # Multi-temple upgrade for databases created before temple_id existed
+        for table in ("bookings", "bookings_archive", "notifications", "notifications_archive", "checkins"):
+            try: cursor.execute(f"ALTER TABLE {table} ADD COLUMN temple_id VARCHAR(50) NOT NULL DEFAULT 'default'")
+            except: pass
+        try:
+            cursor.execute('''
+                ALTER TABLE crowd_forecasts ADD COLUMN temple_id VARCHAR(50) NOT NULL DEFAULT 'default',
+                DROP PRIMARY KEY, ADD PRIMARY KEY (temple_id, forecast_date, time_slot)
+            ''')
+        except: pass
+        try: cursor.execute('CREATE INDEX idx_bookings_temple_date ON bookings(temple_id, booking_date)')
+        except: pass
+        try: cursor.execute('CREATE INDEX idx_notifications_temple_created ON notifications(temple_id, created_at)')
+        except: pass
+
+        # Support search: exact refs, person phone, and n-gram full-text over person names
+        try: cursor.execute('CREATE INDEX idx_bookings_payment_ref ON bookings(payment_ref)')
+        except: pass
+        try: cursor.execute('CREATE INDEX idx_persons_phone ON persons(phone)')
+        except: pass
+        try: cursor.execute('CREATE FULLTEXT INDEX ftx_persons_name ON persons(name) WITH PARSER ngram')
+        except: pass
 
         conn.commit()
         cursor.close()
@@ -198,7 +670,7 @@ def generate_otp():
     return str(random.randint(1000, 9999))
 
 def save_otp(phone, otp_code):
-    conn = get_db_connection()
+    conn = get_db_connection(DEFAULT_SHARD)
     if not conn:
         return False
     try:
@@ -220,7 +692,7 @@ def save_otp(phone, otp_code):
         return False
 
 def verify_otp_in_db(phone, otp_code):
-    conn = get_db_connection()
+    conn = get_db_connection(DEFAULT_SHARD)
     if not conn:
         return False
     try:
@@ -248,14 +720,15 @@ def verify_otp_in_db(phone, otp_code):
             pass
         return False
 
-def insert_notification(title, message, _type='general', booking_id=None):
+def insert_notification(title, message, _type='general', booking_id=None, temple_id=None, recipient_id=None):
     try:
-        conn = get_db_connection()
+        temple_id = temple_id or current_temple_id()
+        conn = get_db_connection(shard_for_temple(temple_id))
         if not conn:
             return False
         cursor = conn.cursor()
-        cursor.execute('INSERT INTO notifications (title, message, type, booking_id) VALUES (%s,%s,%s,%s)',
-                       (title, message, _type, booking_id))
+        cursor.execute('INSERT INTO notifications (temple_id, title, message, type, booking_id, recipient_id) VALUES (%s,%s,%s,%s,%s,%s)',
+                       (temple_id, title, message, _type, booking_id, recipient_id))
         conn.commit()
         cursor.close()
         conn.close()
@@ -287,6 +760,326 @@ def generate_slot_availability(start_date: date, days: int = 60):
         })
     return slots
 
+# ---------- USER CACHE ----------
+USER_PUBLIC_FIELDS = ("id", "user_ref", "phone", "name", "dob", "gender", "address", "created_at")
+
+def user_public_info(user: dict):
+    """Build the JSON-safe profile returned to clients. Never includes the password hash."""
+    return {
+        "id": user["id"],
+        "user_ref": user.get("user_ref"),
+        "phone": user["phone"],
+        "name": user["name"],
+        "dob": str(user["dob"]),
+        "gender": user["gender"],
+        "address": user["address"],
+        "created_at": to_serializable(user["created_at"])
+    }
+
+class UserCache:
+    """
+    Read-through cache of public user profiles keyed by phone.
+    Local mode is a bounded LRU with per-entry TTL. When USER_CACHE_REDIS_URL is set the
+    entries live in Redis instead so invalidations are seen by every worker process.
+    Only user_public_info() output is stored, so password hashes never enter the cache.
+
+    Read-through callers take read_token(phone) before querying MySQL and pass it to put().
+    invalidate() bumps a per-phone generation, and put() drops values read before the bump,
+    so a SELECT that races a PUT /profile commit cannot re-cache the old profile.
+    """
+    def __init__(self, max_entries=10000, ttl_seconds=300, redis_url=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Local generations: global sequence, phone -> seq of its last invalidation (bounded),
+        # and a floor below which tokens are rejected once old invalidations are forgotten
+        self._seq = 0
+        self._invalidated = OrderedDict()
+        self._token_floor = 0
+        self._redis = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "errors": 0}
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+            except Exception as e:
+                print(f"⚠️ User cache: Redis unavailable ({e}), using in-process cache")
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get(self, phone):
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(f"user:{phone}")
+            except Exception as e:
+                print(f"⚠️ User cache get error: {e}")
+                self._count("errors")
+                raw = None
+            self._count("hits" if raw else "misses")
+            return json.loads(raw) if raw else None
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(phone)
+                self.stats["hits"] += 1
+                return dict(entry[1])
+            if entry:
+                del self._entries[phone]
+            self.stats["misses"] += 1
+            return None
+
+    def read_token(self, phone):
+        """Generation marker to take before reading the user from MySQL."""
+        if self._redis is not None:
+            try:
+                return self._redis.get(f"user:{phone}:gen") or b"0"
+            except Exception as e:
+                print(f"⚠️ User cache token error: {e}")
+                self._count("errors")
+                return None
+        with self._lock:
+            return self._seq
+
+    def put(self, phone, user_info: dict, token):
+        """Cache user_info unless phone was invalidated after token was taken."""
+        if token is None:
+            return
+        info = {k: user_info.get(k) for k in USER_PUBLIC_FIELDS}
+        if self._redis is not None:
+            gen_key = f"user:{phone}:gen"
+            try:
+                with self._redis.pipeline() as pipe:
+                    pipe.watch(gen_key)
+                    if (pipe.get(gen_key) or b"0") != token:
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    pipe.setex(f"user:{phone}", self.ttl_seconds, json.dumps(info))
+                    pipe.execute()
+            except Exception as e:
+                # WatchError means an invalidation won the race, which is the point
+                if type(e).__name__ != "WatchError":
+                    print(f"⚠️ User cache put error: {e}")
+                    self._count("errors")
+            return
+        with self._lock:
+            if token < self._token_floor or self._invalidated.get(phone, -1) > token:
+                return
+            self._entries[phone] = (time.monotonic() + self.ttl_seconds, info)
+            self._entries.move_to_end(phone)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, phone):
+        if self._redis is not None:
+            try:
+                with self._redis.pipeline() as pipe:
+                    pipe.incr(f"user:{phone}:gen")
+                    pipe.expire(f"user:{phone}:gen", self.ttl_seconds)
+                    pipe.delete(f"user:{phone}")
+                    pipe.execute()
+            except Exception as e:
+                print(f"⚠️ User cache invalidate error: {e}")
+                self._count("errors")
+        else:
+            with self._lock:
+                self._entries.pop(phone, None)
+                self._seq += 1
+                self._invalidated[phone] = self._seq
+                self._invalidated.move_to_end(phone)
+                while len(self._invalidated) > self.max_entries:
+                    _, seq = self._invalidated.popitem(last=False)
+                    self._token_floor = max(self._token_floor, seq)
+        self._count("invalidations")
+
+    def metrics(self):
+        with self._lock:
+            out = dict(self.stats)
+            out["size"] = len(self._entries) if self._redis is None else None
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+        out["backend"] = "redis" if self._redis is not None else "local"
+        out["max_entries"] = self.max_entries
+        out["ttl_seconds"] = self.ttl_seconds
+        return out
+
+user_cache = UserCache(
+    max_entries=int(os.environ.get("USER_CACHE_SIZE", 10000)),
+    ttl_seconds=int(os.environ.get("USER_CACHE_TTL", 300)),
+    redis_url=os.environ.get("USER_CACHE_REDIS_URL")
+)
+
+# ---------- ADMISSION CONTROL ----------
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class SlotQueue:
+    """
+    FIFO virtual queue for one admission key. Tickets keep their issue index; positions come
+    from counters (head index plus a sorted list of indexes that left out of order) instead of
+    scanning the queue, and expiry walks a heap in deadline order so it stops at the first
+    ticket that is still live.
+    """
+    def __init__(self):
+        self.issued = 0
+        self.head = 0
+        self._gone = []
+        self._live = {}
+        self._deadlines = []
+
+    def __len__(self):
+        return self.issued - self.head - len(self._gone)
+
+    def __contains__(self, ticket):
+        return ticket in self._live
+
+    def add(self, ticket, deadline):
+        self._live[ticket] = [self.issued, deadline]
+        self.issued += 1
+        heapq.heappush(self._deadlines, (deadline, ticket))
+
+    def touch(self, ticket, deadline):
+        self._live[ticket][1] = deadline
+        heapq.heappush(self._deadlines, (deadline, ticket))
+
+    def position(self, ticket):
+        idx = self._live[ticket][0]
+        return idx - self.head - bisect.bisect_left(self._gone, idx) + 1
+
+    def remove(self, ticket):
+        idx = self._live.pop(ticket)[0]
+        if idx == self.head:
+            self.head += 1
+            drop = 0
+            while drop < len(self._gone) and self._gone[drop] == self.head:
+                self.head += 1
+                drop += 1
+            del self._gone[:drop]
+        else:
+            bisect.insort(self._gone, idx)
+
+    def expire(self, now):
+        """Drop tickets whose deadline passed; returns how many were dropped."""
+        dropped = 0
+        while self._deadlines and self._deadlines[0][0] < now:
+            deadline, ticket = heapq.heappop(self._deadlines)
+            entry = self._live.get(ticket)
+            if entry is not None and entry[1] == deadline:
+                self.remove(ticket)
+                dropped += 1
+        return dropped
+
+class AdmissionController:
+    """
+    Admission control for the /book write path, keyed by (date, time_slot).
+    Each key has a token bucket (rate per second, burst capacity) and a FIFO virtual queue.
+    A request is admitted when a token is free and nobody is queued ahead of it; otherwise it
+    receives a queue ticket and a Retry-After hint, and retrying with that ticket keeps its place.
+    A ticket is dropped only if it is not retried within ticket_ttl seconds *after* its
+    Retry-After time, so clients that obey Retry-After never lose their place while abandoned
+    clients cannot stall the queue. Admitted requests then pass a bounded concurrency gate
+    in front of MySQL. State is per process, so with N workers the effective limits are N
+    times these values.
+    """
+    def __init__(self, rate=5.0, burst=10, max_concurrent=8, ticket_ttl=30.0):
+        self.rate = rate
+        self.burst = burst
+        self.ticket_ttl = ticket_ttl
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._queues = {}
+        self._next_ticket = 0
+        self._gate = threading.BoundedSemaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.stats = {"admitted": 0, "queued": 0, "gate_rejected": 0, "expired_tickets": 0}
+
+    def admit(self, key, ticket=None):
+        """Return (True, None) when admitted, else (False, {"ticket", "position", "retry_after"})."""
+        now = time.monotonic()
+        try:
+            ticket = int(ticket) if ticket is not None else None
+        except (TypeError, ValueError):
+            ticket = None
+        with self._lock:
+            if len(self._buckets) > 1024:
+                self._prune(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            bucket.refill(now)
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = SlotQueue()
+            self.stats["expired_tickets"] += queue.expire(now)
+
+            position = None
+            if ticket is not None and ticket in queue:
+                position = queue.position(ticket)
+            # Waiting tickets get the free tokens first, in ticket order
+            ahead = position - 1 if position is not None else len(queue)
+            if bucket.tokens >= 1 and ahead < int(bucket.tokens):
+                bucket.tokens -= 1
+                if position is not None:
+                    queue.remove(ticket)
+                self.stats["admitted"] += 1
+                return True, None
+
+            if position is None:
+                self._next_ticket += 1
+                ticket = self._next_ticket
+                position = len(queue) + 1
+                retry_after = max(1, int(math.ceil(position / self.rate)))
+                queue.add(ticket, now + retry_after + self.ticket_ttl)
+                self.stats["queued"] += 1
+            else:
+                retry_after = max(1, int(math.ceil(position / self.rate)))
+                queue.touch(ticket, now + retry_after + self.ticket_ttl)
+            return False, {"ticket": ticket, "position": position, "retry_after": retry_after}
+
+    def _prune(self, now):
+        """Drop idle keys whose bucket has refilled and whose queue is empty."""
+        for key in [k for k, b in self._buckets.items()
+                    if not self._queues.get(k) and b.tokens + (now - b.updated) * b.rate >= b.capacity]:
+            self._buckets.pop(key, None)
+            self._queues.pop(key, None)
+
+    def enter(self, timeout=2.0):
+        if self._gate.acquire(timeout=timeout):
+            return True
+        with self._lock:
+            self.stats["gate_rejected"] += 1
+        return False
+
+    def leave(self):
+        self._gate.release()
+
+    def metrics(self):
+        with self._lock:
+            out = dict(self.stats)
+            out["queued_now"] = sum(len(q) for q in self._queues.values())
+            out["keys"] = len(self._buckets)
+        out.update(rate=self.rate, burst=self.burst, max_concurrent=self.max_concurrent)
+        return out
+
+booking_admission = AdmissionController(
+    rate=float(os.environ.get("BOOK_RATE_PER_SLOT", 5)),
+    burst=int(os.environ.get("BOOK_BURST", 10)),
+    max_concurrent=int(os.environ.get("BOOK_MAX_CONCURRENT", 8)),
+    ticket_ttl=float(os.environ.get("BOOK_QUEUE_TICKET_TTL", 30))
+)
+
 # ---------- ROUTES ----------
 @app.route("/", methods=["GET"])
 def home():
@@ -363,7 +1156,7 @@ def register():
         except Exception:
             return jsonify({"status": "error", "message": "DOB must be in YYYY-MM-DD format"}), 400
 
-        conn = get_db_connection()
+        conn = get_db_connection(DEFAULT_SHARD)
         if not conn:
             return jsonify({"status": "error", "message": "Database not connected"}), 500
 
@@ -427,26 +1220,19 @@ def login():
         if not phone or not password:
             return jsonify({"status": "error", "message": "Phone and password required"}), 400
 
-        conn = get_db_connection()
+        conn = get_db_connection(DEFAULT_SHARD)
         if not conn:
             return jsonify({"status": "error", "message": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
+        token = user_cache.read_token(phone)
         cursor.execute("SELECT * FROM users WHERE phone=%s", (phone,))
         user = cursor.fetchone()
         cursor.close()
         conn.close()
 
         if user and check_password_hash(user["password"], password):
-            user_info = {
-                "id": user["id"],
-                "user_ref": user.get("user_ref"),
-                "phone": user["phone"],
-                "name": user["name"],
-                "dob": str(user["dob"]),
-                "gender": user["gender"],
-                "address": user["address"],
-                "created_at": to_serializable(user["created_at"])
-            }
+            user_info = user_public_info(user)
+            user_cache.put(phone, user_info, token)
             return jsonify({"status": "success", "message": "Login successful", "user": user_info}), 200
         else:
             return jsonify({"status": "error", "message": "Invalid phone number or password"}), 401
@@ -456,29 +1242,26 @@ def login():
         return jsonify({"status": "error", "message": f"Server error: {str(e)}"}), 500
 
 @app.route("/profile/<phone>", methods=["GET"])
+@stale_if_error
 def get_profile(phone):
     try:
         if not phone:
             return jsonify({"status": "error", "message": "Phone number is required"}), 400
-        conn = get_db_connection()
+        user_info = user_cache.get(phone)
+        if user_info:
+            return jsonify({"status": "success", "user": user_info}), 200
+        conn = get_db_connection(DEFAULT_SHARD)
         if not conn:
             return jsonify({"status": "error", "message": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
+        token = user_cache.read_token(phone)
         cursor.execute("SELECT id, user_ref, phone, name, dob, gender, address, created_at FROM users WHERE phone=%s", (phone,))
         user = cursor.fetchone()
         cursor.close()
         conn.close()
         if user:
-            user_info = {
-                "id": user["id"],
-                "user_ref": user.get("user_ref"),
-                "phone": user["phone"],
-                "name": user["name"],
-                "dob": str(user["dob"]),
-                "gender": user["gender"],
-                "address": user["address"],
-                "created_at": to_serializable(user["created_at"])
-            }
+            user_info = user_public_info(user)
+            user_cache.put(phone, user_info, token)
             return jsonify({"status": "success", "user": user_info}), 200
         else:
             return jsonify({"status": "error", "message": "User not found"}), 404
@@ -504,11 +1287,11 @@ def update_profile():
         except Exception:
             return jsonify({"status": "error", "message": "DOB must be in YYYY-MM-DD format"}), 400
 
-        conn = get_db_connection()
+        conn = get_db_connection(DEFAULT_SHARD)
         if not conn:
             return jsonify({"status": "error", "message": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE phone=%s", (phone,))
+        cursor.execute("SELECT id FROM users WHERE phone=%s", (phone,))
         user = cursor.fetchone()
         if not user:
             cursor.close()
@@ -520,16 +1303,8 @@ def update_profile():
         updated_user = cursor.fetchone()
         cursor.close()
         conn.close()
-        user_info = {
-            "id": updated_user["id"],
-            "user_ref": updated_user.get("user_ref"),
-            "phone": updated_user["phone"],
-            "name": updated_user["name"],
-            "dob": str(updated_user["dob"]),
-            "gender": updated_user["gender"],
-            "address": updated_user["address"],
-            "created_at": to_serializable(updated_user["created_at"])
-        }
+        user_cache.invalidate(phone)
+        user_info = user_public_info(updated_user)
         return jsonify({"status": "success", "message": "Profile updated successfully", "user": user_info}), 200
     except Exception as e:
         print(f"❌ Update profile error: {e}")
@@ -548,11 +1323,11 @@ def reset_password():
         if len(new_password) < 6:
             return jsonify({"status": "error", "message": "Password must be at least 6 characters"}), 400
 
-        conn = get_db_connection()
+        conn = get_db_connection(DEFAULT_SHARD)
         if not conn:
             return jsonify({"status": "error", "message": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE phone=%s", (phone,))
+        cursor.execute("SELECT id FROM users WHERE phone=%s", (phone,))
         user = cursor.fetchone()
         if not user:
             cursor.close()
@@ -563,6 +1338,7 @@ def reset_password():
         conn.commit()
         cursor.close()
         conn.close()
+        user_cache.invalidate(phone)
         return jsonify({"status": "success", "message": "Password reset successfully"}), 200
     except Exception as e:
         print(f"❌ Reset password error: {e}")
@@ -572,7 +1348,7 @@ def reset_password():
 @app.route("/check-tables", methods=["GET"])
 def check_tables():
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(DEFAULT_SHARD)
         if not conn:
             return jsonify({"status": "error", "message": "Database not connected"}), 500
         cursor = conn.cursor()
@@ -593,10 +1369,194 @@ def check_tables():
     except Exception as e:
         return jsonify({"status": "error", "message": f"Error: {str(e)}"}), 500
 
+@app.route("/stats/user-cache", methods=["GET"])
+def user_cache_stats():
+    return jsonify({"status": "success", "user_cache": user_cache.metrics()}), 200
+
+USER_SEARCH_FIELDS = "id, user_ref, phone, name, dob, gender, address, created_at"
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, shape):
+    """Decode a cursor from encode_cursor; raises ValueError unless it is a list matching the types in shape."""
+    values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    if not isinstance(values, list) or len(values) != len(shape):
+        raise ValueError("cursor has the wrong shape")
+    for value, kind in zip(values, shape):
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise ValueError("cursor has the wrong shape")
+    return values
+
+def like_prefix(value):
+    """Escape LIKE wildcards so user input is matched literally as a prefix."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+@app.route("/admin/users/search", methods=["GET"])
+def search_users():
+    """
+    GET /admin/users/search?q=98765&limit=50&cursor=<next_cursor>
+    Also accepts explicit phone_prefix=, name_prefix= or user_ref=. q is classified as a
+    user_ref (USR-...), a phone prefix (digits) or a name prefix. Results use keyset
+    pagination on the matching index (phone, (name, id) or id), so each page costs one
+    bounded index range scan however many users are registered.
+    """
+    try:
+        q = (request.args.get("q") or "").strip()
+        phone_prefix = request.args.get("phone_prefix")
+        name_prefix = request.args.get("name_prefix")
+        user_ref = request.args.get("user_ref")
+        if q and not (phone_prefix or name_prefix or user_ref):
+            if q.upper().startswith("USR-"):
+                user_ref = q
+            elif q.isdigit():
+                phone_prefix = q
+            else:
+                name_prefix = q
+        limit = max(1, min(int(request.args.get("limit", 50)), 200))
+        cursor_param = request.args.get("cursor")
+        shape = (str,) if phone_prefix else (str, int) if name_prefix else (int,)
+        try:
+            after = decode_cursor(cursor_param, shape) if cursor_param else None
+        except Exception:
+            return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+
+        conn = get_db_connection(DEFAULT_SHARD)
+        if not conn:
+            return jsonify({"status": "error", "message": "Database not connected"}), 500
+        cursor = conn.cursor(dictionary=True)
+        if user_ref:
+            cursor.execute(f"SELECT {USER_SEARCH_FIELDS} FROM users WHERE user_ref=%s", (user_ref,))
+            rows = cursor.fetchall()
+            next_cursor = None
+        else:
+            if phone_prefix:
+                where, params, order = "phone LIKE %s", [like_prefix(phone_prefix)], "phone"
+                if after:
+                    where += " AND phone > %s"
+                    params.append(after[0])
+            elif name_prefix:
+                where, params, order = "name LIKE %s", [like_prefix(name_prefix)], "name, id"
+                if after:
+                    where += " AND (name > %s OR (name = %s AND id > %s))"
+                    params += [after[0], after[0], after[1]]
+            else:
+                where, params, order = "1=1", [], "id"
+                if after:
+                    where += " AND id > %s"
+                    params.append(after[0])
+            cursor.execute(
+                f"SELECT {USER_SEARCH_FIELDS} FROM users WHERE {where} ORDER BY {order} LIMIT %s",
+                params + [limit + 1]
+            )
+            rows = cursor.fetchall()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                if phone_prefix:
+                    next_cursor = encode_cursor([last["phone"]])
+                elif name_prefix:
+                    next_cursor = encode_cursor([last["name"], last["id"]])
+                else:
+                    next_cursor = encode_cursor([last["id"]])
+        cursor.close()
+        conn.close()
+        return jsonify({
+            "status": "success",
+            "users": [user_public_info(r) for r in rows],
+            "next_cursor": next_cursor
+        }), 200
+    except Exception as e:
+        print(f"❌ User search error: {e}")
+        return jsonify({"status": "error", "message": f"Server error: {str(e)}"}), 500
+
+def classify_booking_query(q):
+    """Guess which field a free-text support query refers to."""
+    if q.upper().startswith("BK-"):
+        return "booking_ref"
+    if q.isdigit():
+        return "phone"
+    if "-" in q and " " not in q:
+        return "payment_ref"
+    return "name"
+
+@app.route("/admin/bookings/search", methods=["GET"])
+def search_bookings():
+    """
+    GET /admin/bookings/search?q=BK-1a2b3c4d5e&limit=20&cursor=<next_cursor>
+    Also accepts explicit booking_ref=, payment_ref=, phone= or name= (partial person name).
+    booking_ref goes through its unique index, payment_ref and phone through plain indexes,
+    and name through the n-gram FULLTEXT index on persons.name. Pages are keyed on booking
+    id (newest first). Every search runs at most two queries: one for the page of bookings
+    and one for their person_details.
+    """
+    try:
+        filters = {f: request.args.get(f) for f in ("booking_ref", "payment_ref", "phone", "name") if request.args.get(f)}
+        q = (request.args.get("q") or "").strip()
+        if q and not filters:
+            filters[classify_booking_query(q)] = q
+        if len(filters) != 1:
+            return jsonify({"error": "Provide exactly one of q, booking_ref, payment_ref, phone or name"}), 400
+        field, value = next(iter(filters.items()))
+        if field == "name" and len(value) < 2:
+            return jsonify({"error": "name search needs at least 2 characters"}), 400
+        limit = max(1, min(int(request.args.get("limit", 20)), 100))
+        cursor_param = request.args.get("cursor")
+        try:
+            before_id = decode_cursor(cursor_param, (int,))[0] if cursor_param else None
+        except Exception:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+        if field == "booking_ref":
+            where, params = "b.booking_ref = %s", [value]
+        elif field == "payment_ref":
+            where, params = "b.payment_ref = %s", [value]
+        elif field == "phone":
+            where, params = "b.id IN (SELECT booking_id FROM persons WHERE phone = %s)", [value]
+        else:
+            # Quote each word so ngram matching treats it as a phrase; all words must match
+            terms = " ".join('+"' + w.replace('"', '') + '"' for w in value.split())
+            where, params = "b.id IN (SELECT booking_id FROM persons WHERE MATCH(name) AGAINST (%s IN BOOLEAN MODE))", [terms]
+        where += " AND b.temple_id = %s"
+        params.append(current_temple_id())
+        if before_id is not None:
+            where += " AND b.id < %s"
+            params.append(before_id)
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database not connected"}), 500
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"SELECT b.* FROM bookings b WHERE {where} ORDER BY b.id DESC LIMIT %s", params + [limit + 1])
+        bookings = cursor.fetchall()
+        next_cursor = None
+        if len(bookings) > limit:
+            bookings = bookings[:limit]
+            next_cursor = encode_cursor([bookings[-1]["id"]])
+        persons_by_booking = {}
+        if bookings:
+            ids = [b["id"] for b in bookings]
+            placeholders = ",".join(["%s"] * len(ids))
+            cursor.execute(f"SELECT * FROM persons WHERE booking_id IN ({placeholders})", tuple(ids))
+            for p in cursor.fetchall():
+                persons_by_booking.setdefault(p["booking_id"], []).append(serialize_row(p))
+        cursor.close()
+        conn.close()
+        out = []
+        for b in bookings:
+            b_serial = serialize_row(b)
+            b_serial["person_details"] = persons_by_booking.get(b["id"], [])
+            out.append(b_serial)
+        return jsonify({"matched_on": field, "bookings": out, "next_cursor": next_cursor}), 200
+    except Exception as e:
+        print(f"❌ Booking search error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 @app.route("/dev/users", methods=["GET"])
 def get_all_users():
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(DEFAULT_SHARD)
         if not conn:
             return jsonify({"status": "error", "message": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
@@ -625,11 +1585,12 @@ def slots():
         return jsonify({"error": "Invalid 'start' date format. Use YYYY-MM-DD."}), 400
     days = max(1, min(days, 365))
     data = generate_slot_availability(start, days)
-    return jsonify({"start": start.isoformat(), "days": days, "slots": data})
+    return jsonify({"temple_id": current_temple_id(), "start": start.isoformat(), "days": days, "slots": data})
 
 @app.route("/book", methods=["POST"])
 def book():
     conn = None
+    gate_held = False
     try:
         data = request.get_json(force=True)
         if not data:
@@ -653,6 +1614,20 @@ def book():
         if len(person_details) < persons:
             return jsonify({"error": "person_details must contain details for each person"}), 400
 
+        temple_id = current_temple_id()
+        admitted, queue_info = booking_admission.admit((temple_id, date_str, time_slot), data.get("queue_ticket"))
+        if not admitted:
+            return jsonify({
+                "error": "Booking demand for this slot is high, please retry",
+                "queued": True,
+                "queue_ticket": queue_info["ticket"],
+                "queue_position": queue_info["position"],
+                "retry_after": queue_info["retry_after"]
+            }), 429, {"Retry-After": str(queue_info["retry_after"])}
+        if not booking_admission.enter():
+            return jsonify({"error": "Booking service busy, please retry", "retry_after": 1}), 503, {"Retry-After": "1"}
+        gate_held = True
+
         conn = get_db_connection()
         if not conn:
             return jsonify({"error": "Database not connected"}), 500
@@ -662,8 +1637,9 @@ def book():
         booking_ref = ensure_unique_booking_ref(conn)
 
         cursor.execute(
-            "INSERT INTO bookings (booking_ref, title, booking_date, time_slot, persons, amount, paid) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-            (booking_ref, title, date_str, time_slot, persons, amount, False)
+            "INSERT INTO bookings (temple_id, booking_ref, title, booking_date, time_slot, persons, amount, paid, payment_ref) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            (temple_id, booking_ref, title, date_str, time_slot, persons, amount, False, f"QR-{uuid.uuid4().hex[:12]}")
         )
         booking_id = cursor.lastrowid
 
@@ -686,6 +1662,7 @@ def book():
         conn.commit()
         cursor.close()
         conn.close()
+        admin_summary_cache.invalidate((temple_id, date_str))
 
         # Insert notification: booking created (payment pending)
         insert_notification(
@@ -695,7 +1672,7 @@ def book():
             booking_id=booking_id
         )
 
-        return jsonify({"success": True, "booking_id": booking_id, "booking_ref": booking_ref, "message": "Booking created (payment pending)"}), 201
+        return jsonify({"success": True, "booking_id": booking_id, "booking_ref": booking_ref, "temple_id": temple_id, "message": "Booking created (payment pending)"}), 201
     except Error as e:
         print(f"❌ Booking DB error: {e}")
         try:
@@ -712,6 +1689,9 @@ def book():
         except:
             pass
         return jsonify({"error": f"Server error: {str(e)}"}), 500
+    finally:
+        if gate_held:
+            booking_admission.leave()
 
 @app.route("/payment", methods=["POST"])
 def payment():
@@ -732,12 +1712,20 @@ def payment():
             return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
 
-        cursor.execute("SELECT * FROM bookings WHERE id=%s", (booking_id,))
+        temple_id = current_temple_id()
+        # Row lock so the expiry sweeper cannot release this hold while it is being paid
+        cursor.execute("SELECT * FROM bookings WHERE id=%s AND temple_id=%s FOR UPDATE", (booking_id, temple_id))
         booking = cursor.fetchone()
         if not booking:
+            conn.rollback()
             cursor.close()
             conn.close()
             return jsonify({"error": "Booking not found"}), 404
+        if booking.get("expired_at") and not booking.get("paid"):
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({"error": "Booking hold expired, please book again"}), 409
 
         cursor.execute("UPDATE bookings SET paid=%s, amount=%s, payment_ref=%s WHERE id=%s", (True, amount, payment_ref, booking_id))
         conn.commit()
@@ -745,6 +1733,7 @@ def payment():
         updated = cursor.fetchone()
         cursor.close()
         conn.close()
+        admin_summary_cache.invalidate((temple_id, str(updated["booking_date"])))
 
         # Insert payment success notification
         insert_notification(
@@ -773,6 +1762,7 @@ def payment():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/notifications", methods=["GET"])
+@stale_if_error
 def notifications():
     try:
         limit = int(request.args.get("limit", 50))
@@ -780,7 +1770,11 @@ def notifications():
         if not conn:
             return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM notifications ORDER BY created_at DESC LIMIT %s", (limit,))
+        # Admin events and broadcasts only; personal messages are served by /notifications/feed
+        cursor.execute(
+            "SELECT * FROM notifications WHERE temple_id=%s AND (recipient_id IS NULL OR recipient_id = 0) ORDER BY created_at DESC LIMIT %s",
+            (current_temple_id(), limit)
+        )
         notes = cursor.fetchall()
         out = []
         for n in notes:
@@ -805,12 +1799,41 @@ def notifications():
 
 @app.route("/notifications/<int:notification_id>/read", methods=["PUT"])
 def mark_notification_read(notification_id):
+    """
+    PUT /notifications/<id>/read?user_id=12
+    With user_id, a broadcast is marked read for that user only (one notification_reads row)
+    and a personal notification only if it belongs to them. Without user_id (the /notifications
+    screens) the notification's own is_read flag is set, as before broadcasts existed.
+    """
     try:
+        body = request.get_json(silent=True)
+        user_id = request.args.get("user_id") or (body.get("user_id") if isinstance(body, dict) else None)
+        if user_id is not None:
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                return jsonify({"error": "user_id must be an integer"}), 400
+            if user_id <= 0:
+                return jsonify({"error": "user_id must be positive"}), 400
+        temple_id = current_temple_id()
         conn = get_db_connection()
         if not conn:
             return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor()
-        cursor.execute("UPDATE notifications SET is_read=TRUE WHERE id=%s", (notification_id,))
+        if user_id is not None:
+            cursor.execute('''
+                INSERT IGNORE INTO notification_reads (user_id, notification_id)
+                SELECT %s, id FROM notifications WHERE id=%s AND temple_id=%s AND recipient_id=0
+            ''', (user_id, notification_id, temple_id))
+            cursor.execute(
+                "UPDATE notifications SET is_read=TRUE WHERE id=%s AND temple_id=%s AND (recipient_id IS NULL OR recipient_id = %s)",
+                (notification_id, temple_id, user_id)
+            )
+        else:
+            cursor.execute(
+                "UPDATE notifications SET is_read=TRUE WHERE id=%s AND temple_id=%s AND (recipient_id IS NULL OR recipient_id = 0)",
+                (notification_id, temple_id)
+            )
         conn.commit()
         cursor.close()
         conn.close()
@@ -820,13 +1843,14 @@ def mark_notification_read(notification_id):
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/history", methods=["GET"])
+@stale_if_error
 def history():
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM bookings ORDER BY created_at DESC")
+        cursor.execute("SELECT * FROM bookings WHERE temple_id=%s AND expired_at IS NULL ORDER BY created_at DESC", (current_temple_id(),))
         bookings = cursor.fetchall()
         out = []
         for b in bookings:
@@ -846,6 +1870,7 @@ def history():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/history/user", methods=["GET"])
+@stale_if_error
 def history_user():
     """
     GET /history/user?phone=9876543210
@@ -871,8 +1896,8 @@ def history_user():
             return jsonify({"history": []}), 200
 
         placeholders = ",".join(["%s"] * len(booking_ids))
-        query = f"SELECT * FROM bookings WHERE id IN ({placeholders}) ORDER BY created_at DESC"
-        cursor.execute(query, tuple(booking_ids))
+        query = f"SELECT * FROM bookings WHERE id IN ({placeholders}) AND temple_id=%s ORDER BY created_at DESC"
+        cursor.execute(query, tuple(booking_ids) + (current_temple_id(),))
         bookings = cursor.fetchall()
         out = []
         for b in bookings:
@@ -897,13 +1922,14 @@ def history_user():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/booking/<int:booking_id>", methods=["GET"])
+@stale_if_error
 def get_booking(booking_id):
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM bookings WHERE id=%s", (booking_id,))
+        cursor.execute("SELECT * FROM bookings WHERE id=%s AND temple_id=%s", (booking_id, current_temple_id()))
         booking = cursor.fetchone()
         if not booking:
             cursor.close()
@@ -926,7 +1952,12 @@ def get_booking(booking_id):
 def booking_qr(booking_id):
     """
     Returns qr_payload:
-    { "qr_payload": { "booking_id": 1, "booking_ref": "BK-...", "amount": 200, "payment_ref": "QR-abc123", "paid": false } }
+    { "qr_payload": { "booking_id": 1, "booking_ref": "BK-...", "amount": 200, "payment_ref": "QR-abc123", "paid": false,
+                      "ticket": "v1.<kid>.<payload>.<sig>" } }
+    ticket is the signed token to encode in the QR; gates verify it offline via qr_tickets.verify_ticket.
+    It is null when ticket signing is not configured.
+    Read-only: /book assigns payment_ref, and older bookings without one get a ref derived from
+    booking_ref so repeated GETs agree without writing to the database.
     """
     conn = None
     try:
@@ -934,25 +1965,25 @@ def booking_qr(booking_id):
         if not conn:
             return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, booking_ref, amount, paid, payment_ref FROM bookings WHERE id=%s", (booking_id,))
+        cursor.execute(
+            "SELECT id, temple_id, booking_ref, booking_date, time_slot, persons, amount, paid, payment_ref FROM bookings WHERE id=%s AND temple_id=%s",
+            (booking_id, current_temple_id())
+        )
         booking = cursor.fetchone()
         if not booking:
             cursor.close()
             conn.close()
             return jsonify({"error": "Booking not found"}), 404
 
-        payment_ref = booking.get("payment_ref")
-        if not payment_ref:
-            payment_ref = f"QR-{uuid.uuid4().hex[:12]}"
-            cursor.execute("UPDATE bookings SET payment_ref=%s WHERE id=%s", (payment_ref, booking_id))
-            conn.commit()
+        payment_ref = booking.get("payment_ref") or f"QR-{uuid.uuid5(uuid.NAMESPACE_URL, booking['booking_ref']).hex[:12]}"
 
         payload = {
             "booking_id": booking_id,
             "booking_ref": booking.get("booking_ref"),
             "amount": int(booking.get("amount", 0)),
             "payment_ref": payment_ref,
-            "paid": bool(booking.get("paid", False))
+            "paid": bool(booking.get("paid", False)),
+            "ticket": sign_ticket(ticket_claims(booking), qr_keys, qr_active_kid) if qr_keys else None
         }
         cursor.close()
         conn.close()
@@ -966,6 +1997,33 @@ def booking_qr(booking_id):
             pass
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route("/tickets/verify", methods=["POST"])
+def verify_ticket_route():
+    """
+    POST /tickets/verify { "ticket": "v1...." }
+    Validates signature and expiry only - no database access.
+    """
+    if not qr_keys:
+        return jsonify({"valid": False, "error": "Ticket verification is not configured"}), 503
+    data = request.get_json(silent=True) or {}
+    token = data.get("ticket")
+    if not token:
+        return jsonify({"valid": False, "error": "ticket is required"}), 400
+    try:
+        claims = verify_ticket(token, qr_keys)
+    except InvalidTicket as e:
+        return jsonify({"valid": False, "error": str(e)}), 200
+    return jsonify({
+        "valid": True,
+        "temple_id": claims.get("t", DEFAULT_TEMPLE_ID),
+        "booking_id": claims["i"],
+        "booking_ref": claims["r"],
+        "date": claims["d"],
+        "time_slot": claims["s"],
+        "persons": claims["n"],
+        "paid": bool(claims["p"])
+    }), 200
+
 @app.route("/dev/clear-bookings", methods=["POST"])
 def clear_bookings():
     try:
@@ -973,12 +2031,15 @@ def clear_bookings():
         if not conn:
             return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM persons")
-        cursor.execute("DELETE FROM bookings")
-        cursor.execute("DELETE FROM notifications")
+        temple_id = current_temple_id()
+        cursor.execute("DELETE p FROM persons p JOIN bookings b ON b.id = p.booking_id WHERE b.temple_id=%s", (temple_id,))
+        cursor.execute("DELETE r FROM notification_reads r JOIN notifications n ON n.id = r.notification_id WHERE n.temple_id=%s", (temple_id,))
+        cursor.execute("DELETE FROM notifications WHERE temple_id=%s", (temple_id,))
+        cursor.execute("DELETE FROM bookings WHERE temple_id=%s", (temple_id,))
         conn.commit()
         cursor.close()
         conn.close()
+        admin_summary_cache.clear()
         return jsonify({"success": True, "message": "All bookings & notifications cleared (DEV)"}), 200
     except Exception as e:
         print(f"❌ Clear bookings error: {e}")
@@ -988,7 +2049,23 @@ def clear_bookings():
             pass
         return jsonify({"error": f"Server error: {str(e)}"}), 500
     
+@app.route("/stats/db-health", methods=["GET"])
+def db_health():
+    return jsonify({
+        "status": "success",
+        "shards": {
+            shard: {"breaker_state": b.state, "consecutive_failures": b.failures}
+            for shard, b in db_breakers.items()
+        },
+        "stale_entries": len(stale_cache._entries)
+    }), 200
+
+@app.route("/stats/admission", methods=["GET"])
+def admission_stats():
+    return jsonify({"status": "success", "admission": booking_admission.metrics()}), 200
+
 @app.route("/stats/bookings-count", methods=["GET"])
+@stale_if_error
 def get_bookings_count():
     try:
         date_param = request.args.get("date")  # yyyy-mm-dd format
@@ -997,9 +2074,14 @@ def get_bookings_count():
             return jsonify({"error": "date parameter required e.g. ?date=2025-11-28"}), 400
 
         conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database not connected"}), 500
         cursor = conn.cursor()
 
-        cursor.execute("SELECT SUM(persons) FROM bookings WHERE booking_date = %s", (date_param,))
+        cursor.execute(
+            "SELECT SUM(persons) FROM bookings WHERE temple_id = %s AND booking_date = %s AND expired_at IS NULL",
+            (current_temple_id(), date_param)
+        )
         result = cursor.fetchone()
         total_people = result[0] if result[0] is not None else 0
 
@@ -1008,6 +2090,7 @@ def get_bookings_count():
 
         return jsonify({
             "status": "success",
+            "temple_id": current_temple_id(),
             "date": date_param,
             "total_people": total_people
         }), 200
@@ -1015,12 +2098,1516 @@ def get_bookings_count():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+# ---------- ARCHIVE ----------
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("ARCHIVE_RETENTION_DAYS", 180))
+
+def archive_bookings(retention_days=ARCHIVE_RETENTION_DAYS, batch_size=500, sleep_ms=200, max_batches=None, shard=DEFAULT_SHARD):
+    """
+    Move bookings whose darshan date is older than retention_days into the *_archive tables,
+    together with their persons and notifications. Each batch is its own short transaction
+    keyed on the primary key, and the job sleeps between batches so it never holds long locks.
+    Booking-less notifications past the same window are archived afterwards. Runs on one shard.
+    """
+    conn = get_db_connection(shard)
+    if not conn:
+        print("❌ Cannot archive - no database connection")
+        return None
+    stats = {"bookings": 0, "persons": 0, "notifications": 0, "batches": 0}
+    cutoff = date.today() - timedelta(days=retention_days)
+    try:
+        cursor = conn.cursor()
+        while max_batches is None or stats["batches"] < max_batches:
+            cursor.execute("SELECT id FROM bookings WHERE booking_date < %s ORDER BY id LIMIT %s", (cutoff, batch_size))
+            ids = [r[0] for r in cursor.fetchall()]
+            if not ids:
+                break
+            placeholders = ",".join(["%s"] * len(ids))
+            cursor.execute(f"INSERT INTO bookings_archive SELECT * FROM bookings WHERE id IN ({placeholders})", ids)
+            cursor.execute(f"INSERT INTO persons_archive SELECT * FROM persons WHERE booking_id IN ({placeholders})", ids)
+            stats["persons"] += cursor.rowcount
+            cursor.execute(f"INSERT INTO notifications_archive SELECT * FROM notifications WHERE booking_id IN ({placeholders})", ids)
+            stats["notifications"] += cursor.rowcount
+            cursor.execute(f"DELETE FROM notifications WHERE booking_id IN ({placeholders})", ids)
+            cursor.execute(f"DELETE FROM persons WHERE booking_id IN ({placeholders})", ids)
+            cursor.execute(f"DELETE FROM bookings WHERE id IN ({placeholders})", ids)
+            conn.commit()
+            stats["bookings"] += len(ids)
+            stats["batches"] += 1
+            time.sleep(sleep_ms / 1000.0)
+
+        while max_batches is None or stats["batches"] < max_batches:
+            cursor.execute(
+                "SELECT id FROM notifications WHERE booking_id IS NULL AND created_at < %s ORDER BY id LIMIT %s",
+                (cutoff, batch_size)
+            )
+            ids = [r[0] for r in cursor.fetchall()]
+            if not ids:
+                break
+            placeholders = ",".join(["%s"] * len(ids))
+            cursor.execute(f"INSERT INTO notifications_archive SELECT * FROM notifications WHERE id IN ({placeholders})", ids)
+            cursor.execute(f"DELETE FROM notification_reads WHERE notification_id IN ({placeholders})", ids)
+            cursor.execute(f"DELETE FROM notifications WHERE id IN ({placeholders})", ids)
+            conn.commit()
+            stats["notifications"] += len(ids)
+            stats["batches"] += 1
+            time.sleep(sleep_ms / 1000.0)
+
+        cursor.close()
+        conn.close()
+        admin_summary_cache.clear()
+        return stats
+    except Error as e:
+        print(f"❌ Archive error: {e}")
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        return None
+
+@app.cli.command("archive-bookings")
+@click.option("--retention-days", default=ARCHIVE_RETENTION_DAYS, show_default=True, help="Keep bookings newer than this in the hot tables.")
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--sleep-ms", default=200, show_default=True, help="Pause between batches.")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches.")
+def archive_bookings_command(retention_days, batch_size, sleep_ms, max_batches):
+    """Move old bookings, persons and notifications to the archive tables on every shard."""
+    failed = False
+    for shard in db_shards:
+        stats = archive_bookings(retention_days, batch_size, sleep_ms, max_batches, shard=shard)
+        if stats is None:
+            failed = True
+            continue
+        print(f"✅ [{shard}] Archived {stats['bookings']} bookings, {stats['persons']} persons, "
+              f"{stats['notifications']} notifications in {stats['batches']} batches")
+    if failed:
+        raise SystemExit(1)
+
+@app.route("/history/archive", methods=["GET"])
+@stale_if_error
+def history_archive():
+    """
+    GET /history/archive?start=2024-01-01&end=2024-03-31&phone=9876543210&limit=100
+    Reads archived bookings (with person_details) from the cold tables. phone is optional.
+    """
+    try:
+        start_str = request.args.get("start")
+        end_str = request.args.get("end")
+        phone = request.args.get("phone")
+        limit = max(1, min(int(request.args.get("limit", 100)), 500))
+        try:
+            start = datetime.datetime.strptime(start_str, "%Y-%m-%d").date() if start_str else date(1970, 1, 1)
+            end = datetime.datetime.strptime(end_str, "%Y-%m-%d").date() if end_str else date.today()
+        except Exception:
+            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database not connected"}), 500
+        cursor = conn.cursor(dictionary=True)
+        temple_id = current_temple_id()
+        if phone:
+            cursor.execute('''
+                SELECT * FROM bookings_archive
+                WHERE temple_id = %s AND booking_date BETWEEN %s AND %s
+                  AND id IN (SELECT booking_id FROM persons_archive WHERE phone=%s)
+                ORDER BY booking_date DESC, id DESC LIMIT %s
+            ''', (temple_id, start, end, phone, limit))
+        else:
+            cursor.execute('''
+                SELECT * FROM bookings_archive
+                WHERE temple_id = %s AND booking_date BETWEEN %s AND %s
+                ORDER BY booking_date DESC, id DESC LIMIT %s
+            ''', (temple_id, start, end, limit))
+        bookings = cursor.fetchall()
+        persons_by_booking = {}
+        if bookings:
+            ids = [b['id'] for b in bookings]
+            placeholders = ",".join(["%s"] * len(ids))
+            cursor.execute(f"SELECT * FROM persons_archive WHERE booking_id IN ({placeholders})", tuple(ids))
+            for p in cursor.fetchall():
+                persons_by_booking.setdefault(p['booking_id'], []).append(serialize_row(p))
+        cursor.close()
+        conn.close()
+        out = []
+        for b in bookings:
+            b_serial = serialize_row(b)
+            b_serial['person_details'] = persons_by_booking.get(b['id'], [])
+            b_serial['archived'] = True
+            out.append(b_serial)
+        return jsonify({"history": out}), 200
+    except Exception as e:
+        print(f"❌ History archive error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+# ---------- BATCH ----------
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 20))
+BATCH_READ_WORKERS = int(os.environ.get("BATCH_READ_WORKERS", 4))
+BATCH_METHODS = ("GET", "POST", "PUT", "DELETE")
+
+def _batch_method(item):
+    return str(item.get("method", "GET")).upper() if isinstance(item, dict) else None
+
+def run_batch_item(item, headers=None):
+    """Dispatch one sub-request through the normal Flask routing and return its result entry."""
+    if not isinstance(item, dict):
+        return {"id": None, "status": 400, "ok": False, "body": {"error": "Each request must be a JSON object"}}
+    method = _batch_method(item)
+    path = item.get("path")
+    entry = {"id": item.get("id"), "method": method, "path": path}
+    if method not in BATCH_METHODS:
+        entry.update(status=400, body={"error": f"Unsupported method: {method}"})
+    elif not isinstance(path, str) or not path.startswith("/"):
+        entry.update(status=400, body={"error": "path must be an absolute route like /booking/1"})
+    elif path.split("?", 1)[0].rstrip("/") == "/batch":
+        entry.update(status=400, body={"error": "Nested /batch requests are not allowed"})
+    else:
+        try:
+            # Sub-requests are part of the /batch call: capture records the batch once, not each item
+            with app.test_request_context(path, method=method, json=item.get("body"), headers=headers,
+                                          environ_base={SKIP_ENVIRON_KEY: True}):
+                resp = app.full_dispatch_request()
+            entry["status"] = resp.status_code
+            entry["body"] = resp.get_json(silent=True)
+        except Exception as e:
+            print(f"❌ Batch item error ({method} {path}): {e}")
+            entry.update(status=500, body={"error": f"Server error: {str(e)}"})
+    entry["ok"] = 200 <= entry["status"] < 300
+    return entry
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """
+    POST /batch
+    {
+      "requests": [
+        {"id": "booking", "method": "GET", "path": "/booking/12"},
+        {"id": "qr", "method": "GET", "path": "/booking/12/qr"},
+        {"id": "pay", "method": "POST", "path": "/payment", "body": {"booking_id": 12, "amount": 200}}
+      ],
+      "stop_on_error": false,
+      "parallel_reads": true
+    }
+    Sub-requests run in order and share one pooled DB connection, checked out when the first
+    of them needs it; if that fails, each item fails (or serves stale) on its own. When parallel_reads is
+    set, a run of consecutive GETs is fanned out over separate pooled connections.
+    Every result carries its own HTTP status and JSON body; ok is true for 2xx. With
+    stop_on_error, items after the first failure are not run and report status 424.
+    The batch itself returns 200 whenever the envelope is valid.
+    """
+    shared = None
+    try:
+        data = request.get_json(force=True)
+        if not isinstance(data, dict) or not isinstance(data.get("requests"), list):
+            return jsonify({"error": "JSON body with a 'requests' list required"}), 400
+        items = data["requests"]
+        if not items:
+            return jsonify({"error": "requests must not be empty"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"error": f"At most {BATCH_MAX_ITEMS} requests per batch"}), 400
+        stop_on_error = bool(data.get("stop_on_error", False))
+        parallel_reads = bool(data.get("parallel_reads", True))
+
+        shared = _db_local.shared_conn = SharedConnection(shard_for_temple(current_temple_id()))
+        temple_headers = {"X-Temple-Id": current_temple_id()}
+
+        results = [None] * len(items)
+        failed = False
+        i = 0
+        while i < len(items):
+            if failed and stop_on_error:
+                item = items[i] if isinstance(items[i], dict) else {}
+                results[i] = {"id": item.get("id"), "method": _batch_method(items[i]), "path": item.get("path"),
+                              "status": 424, "ok": False, "body": {"error": "Skipped after an earlier failure"}}
+                i += 1
+                continue
+            j = i + 1
+            if parallel_reads and _batch_method(items[i]) == "GET":
+                while j < len(items) and _batch_method(items[j]) == "GET":
+                    j += 1
+            if j - i > 1:
+                # Worker threads have no shared_conn, so each read takes its own pooled connection
+                with ThreadPoolExecutor(max_workers=max(1, min(BATCH_READ_WORKERS, j - i))) as ex:
+                    results[i:j] = list(ex.map(lambda it: run_batch_item(it, temple_headers), items[i:j]))
+            else:
+                results[i] = run_batch_item(items[i], temple_headers)
+            if any(not r["ok"] for r in results[i:j]):
+                failed = True
+            i = j
+
+        all_ok = all(r["ok"] for r in results)
+        return jsonify({
+            "status": "success" if all_ok else "partial",
+            "count": len(results),
+            "responses": results
+        }), 200
+    except Exception as e:
+        print(f"❌ Batch error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+    finally:
+        _db_local.shared_conn = None
+        if shared is not None and shared._conn is not None:
+            try:
+                shared._conn.rollback()
+                shared._conn.close()
+            except:
+                pass
+
+
+# ---------- CROWD FORECAST ----------
+FORECAST_HISTORY_DAYS = 364
+FORECAST_TRAILING_DAYS = 28
+
+def compute_crowd_forecast(horizon_days=60, temple_id=DEFAULT_TEMPLE_ID):
+    """
+    Nightly job: forecast persons per date and slot for the next horizon_days and store the
+    result in crowd_forecasts for one temple. History is aggregated in SQL and then handled as NumPy arrays:
+      baseline = trailing per-slot daily average x weekday seasonality factor
+      pace     = persons already booked + last-24h booking velocity x days left until the date
+      expected = max(baseline, pace)
+    """
+    import numpy as np
+
+    conn = get_db_connection(shard_for_temple(temple_id))
+    if not conn:
+        print("❌ Cannot compute forecast - no database connection")
+        return None
+    try:
+        today = date.today()
+        hist_start = today - timedelta(days=FORECAST_HISTORY_DAYS)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT booking_date, time_slot, SUM(persons) FROM bookings
+            WHERE temple_id = %s AND booking_date >= %s AND booking_date < %s AND expired_at IS NULL
+            GROUP BY booking_date, time_slot
+        ''', (temple_id, hist_start, today))
+        history = cursor.fetchall()
+        cursor.execute('''
+            SELECT booking_date, time_slot, SUM(persons),
+                   SUM(CASE WHEN created_at >= NOW() - INTERVAL 1 DAY THEN persons ELSE 0 END)
+            FROM bookings
+            WHERE temple_id = %s AND booking_date >= %s AND booking_date < %s AND expired_at IS NULL
+            GROUP BY booking_date, time_slot
+        ''', (temple_id, today, today + timedelta(days=horizon_days)))
+        upcoming = cursor.fetchall()
+
+        slots = sorted({r[1] for r in history} | {r[1] for r in upcoming})
+        if not slots:
+            cursor.close()
+            conn.close()
+            return {"rows": 0, "slots": 0}
+        slot_idx = {s: i for i, s in enumerate(slots)}
+
+        # hist[d, s]: persons on day hist_start + d in slot s
+        hist = np.zeros((FORECAST_HISTORY_DAYS, len(slots)))
+        if history:
+            d_idx = np.array([(r[0] - hist_start).days for r in history])
+            s_idx = np.array([slot_idx[r[1]] for r in history])
+            np.add.at(hist, (d_idx, s_idx), np.array([float(r[2]) for r in history]))
+
+        hist_weekdays = (hist_start.weekday() + np.arange(FORECAST_HISTORY_DAYS)) % 7
+        slot_mean = hist.mean(axis=0)
+        weekday_mean = np.stack([hist[hist_weekdays == w].mean(axis=0) for w in range(7)])
+        seasonality = np.divide(weekday_mean, slot_mean, out=np.ones_like(weekday_mean), where=slot_mean > 0)
+        trailing = hist[-FORECAST_TRAILING_DAYS:].mean(axis=0)
+
+        future_weekdays = (today.weekday() + np.arange(horizon_days)) % 7
+        baseline = trailing[None, :] * seasonality[future_weekdays]
+
+        booked = np.zeros((horizon_days, len(slots)))
+        velocity = np.zeros((horizon_days, len(slots)))
+        if upcoming:
+            d_idx = np.array([(r[0] - today).days for r in upcoming])
+            s_idx = np.array([slot_idx[r[1]] for r in upcoming])
+            booked[d_idx, s_idx] = [float(r[2]) for r in upcoming]
+            velocity[d_idx, s_idx] = [float(r[3]) for r in upcoming]
+        days_left = np.arange(horizon_days)[:, None]
+        expected = np.maximum(baseline, booked + velocity * days_left)
+
+        computed_at = datetime.datetime.now()
+        rows = [
+            (temple_id, today + timedelta(days=int(d)), slots[s], int(round(expected[d, s])), int(booked[d, s]),
+             round(float(baseline[d, s]), 2), computed_at)
+            for d in range(horizon_days) for s in range(len(slots))
+        ]
+        cursor.executemany('''
+            INSERT INTO crowd_forecasts (temple_id, forecast_date, time_slot, expected_persons, booked_persons, baseline, computed_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE expected_persons=VALUES(expected_persons), booked_persons=VALUES(booked_persons),
+                                    baseline=VALUES(baseline), computed_at=VALUES(computed_at)
+        ''', rows)
+        conn.commit()
+        cursor.close()
+        conn.close()
+        return {"rows": len(rows), "slots": len(slots)}
+    except Error as e:
+        print(f"❌ Forecast error: {e}")
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        return None
+
+@app.cli.command("compute-forecast")
+@click.option("--horizon-days", default=60, show_default=True)
+def compute_forecast_command(horizon_days):
+    """Recompute crowd_forecasts for every temple (run nightly from cron)."""
+    failed = False
+    for temple_id in list_temples():
+        result = compute_crowd_forecast(horizon_days, temple_id)
+        if result is None:
+            failed = True
+            continue
+        print(f"✅ [{temple_id}] Stored {result['rows']} forecast rows for {result['slots']} slots")
+    if failed:
+        raise SystemExit(1)
+
+@app.route("/stats/forecast", methods=["GET"])
+@stale_if_error
+def get_forecast():
+    """
+    GET /stats/forecast?start=2025-12-01&days=14
+    Serves the precomputed crowd_forecasts rows; nothing is computed per request.
+    """
+    try:
+        start_str = request.args.get("start")
+        days = max(1, min(int(request.args.get("days", 14)), 60))
+        try:
+            start = datetime.datetime.strptime(start_str, "%Y-%m-%d").date() if start_str else date.today()
+        except Exception:
+            return jsonify({"error": "Invalid 'start' date format. Use YYYY-MM-DD."}), 400
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database not connected"}), 500
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute('''
+            SELECT forecast_date, time_slot, expected_persons, booked_persons, computed_at
+            FROM crowd_forecasts
+            WHERE temple_id = %s AND forecast_date BETWEEN %s AND %s
+            ORDER BY forecast_date, time_slot
+        ''', (current_temple_id(), start, start + timedelta(days=days - 1)))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return jsonify({
+            "status": "success",
+            "temple_id": current_temple_id(),
+            "start": start.isoformat(),
+            "days": days,
+            "forecast": [serialize_row(r) for r in rows]
+        }), 200
+    except Exception as e:
+        print(f"❌ Forecast read error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+# ---------- ADMIN SUMMARY ----------
+class TTLCache:
+    """Small thread-safe key -> value cache with a fixed TTL and explicit invalidation."""
+    def __init__(self, ttl_seconds, max_entries=1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+admin_summary_cache = TTLCache(int(os.environ.get("ADMIN_SUMMARY_TTL", 15)))
+
+def build_admin_summary(date_str, temple_id=DEFAULT_TEMPLE_ID):
+    """Aggregate one temple's dashboard numbers for a day with two grouped queries."""
+    conn = get_db_connection(shard_for_temple(temple_id))
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute('''
+            SELECT time_slot,
+                   COUNT(*) AS bookings,
+                   COALESCE(SUM(persons), 0) AS persons,
+                   COALESCE(SUM(paid = TRUE), 0) AS paid_bookings,
+                   COALESCE(SUM(paid = FALSE), 0) AS unpaid_bookings,
+                   COALESCE(SUM(CASE WHEN paid = TRUE THEN amount ELSE 0 END), 0) AS revenue
+            FROM bookings
+            WHERE temple_id = %s AND booking_date = %s AND expired_at IS NULL
+            GROUP BY time_slot
+            ORDER BY time_slot
+        ''', (temple_id, date_str))
+        slot_rows = cursor.fetchall()
+        cursor.execute('''
+            SELECT b.time_slot,
+                   COALESCE(SUM(p.wheelchair_required = TRUE), 0) AS wheelchair_required,
+                   COALESCE(SUM(p.is_elder_disabled = TRUE), 0) AS elder_disabled
+            FROM persons p
+            JOIN bookings b ON b.id = p.booking_id
+            WHERE b.temple_id = %s AND b.booking_date = %s AND b.expired_at IS NULL
+            GROUP BY b.time_slot
+        ''', (temple_id, date_str))
+        access = {r["time_slot"]: r for r in cursor.fetchall()}
+        cursor.close()
+        conn.close()
+    except Error as e:
+        print(f"❌ Admin summary error: {e}")
+        try:
+            conn.close()
+        except:
+            pass
+        return None
+
+    fields = ("bookings", "persons", "paid_bookings", "unpaid_bookings", "revenue", "wheelchair_required", "elder_disabled")
+    totals = {f: 0 for f in fields}
+    slots_out = []
+    for r in slot_rows:
+        a = access.get(r["time_slot"], {})
+        slot = {
+            "time_slot": r["time_slot"],
+            "bookings": int(r["bookings"]),
+            "persons": int(r["persons"]),
+            "paid_bookings": int(r["paid_bookings"]),
+            "unpaid_bookings": int(r["unpaid_bookings"]),
+            "revenue": int(r["revenue"]),
+            "wheelchair_required": int(a.get("wheelchair_required", 0)),
+            "elder_disabled": int(a.get("elder_disabled", 0)),
+        }
+        for f in fields:
+            totals[f] += slot[f]
+        slots_out.append(slot)
+    return {
+        "temple_id": temple_id,
+        "date": date_str,
+        "totals": totals,
+        "slots": slots_out,
+        "generated_at": datetime.datetime.now().isoformat()
+    }
+
+@app.route("/admin/summary", methods=["GET"])
+@stale_if_error
+def admin_summary():
+    """
+    GET /admin/summary?date=2025-11-28
+    Whole admin dashboard for one date: per-slot bookings, persons, paid/unpaid counts, revenue
+    and accessibility logistics. Cached for ADMIN_SUMMARY_TTL seconds and dropped on /book and /payment.
+    """
+    try:
+        date_str = request.args.get("date") or date.today().isoformat()
+        try:
+            datetime.datetime.strptime(date_str, "%Y-%m-%d")
+        except Exception:
+            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+        temple_id = current_temple_id()
+        summary = admin_summary_cache.get((temple_id, date_str))
+        cached = summary is not None
+        if not cached:
+            summary = build_admin_summary(date_str, temple_id)
+            if summary is None:
+                return jsonify({"error": "Database not connected"}), 500
+            admin_summary_cache.put((temple_id, date_str), summary)
+        return jsonify({"status": "success", "cached": cached, **summary}), 200
+    except Exception as e:
+        print(f"❌ Admin summary route error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+# ---------- CHECK-IN ----------
+CHECKIN_INSERT_CHUNK = 1000
+# How long after a scan a gate device may upload it, and how far ahead of server time its clock may run
+CHECKIN_OFFLINE_GRACE = int(os.environ.get("CHECKIN_OFFLINE_GRACE", 6 * 3600))
+CHECKIN_CLOCK_SKEW = int(os.environ.get("CHECKIN_CLOCK_SKEW", 300))
+
+class CheckinRegistry:
+    """
+    In-memory per-date set of checked-in booking ids, so duplicate scans are caught without a
+    DB round trip. A date is seeded from the checkins table the first time this process sees it;
+    the UNIQUE (checkin_date, booking_id) key stays the final guard across worker processes.
+    """
+    def __init__(self, keep_days=2):
+        self.keep_days = keep_days
+        self._dates = {}
+        self._lock = threading.Lock()
+
+    def _load(self, conn, temple_id, checkin_date):
+        cursor = conn.cursor()
+        cursor.execute("SELECT booking_id FROM checkins WHERE temple_id=%s AND checkin_date=%s", (temple_id, checkin_date))
+        seen = {r[0] for r in cursor.fetchall()}
+        cursor.close()
+        return seen
+
+    def claim(self, conn, temple_id, checkin_date, booking_ids):
+        """Add booking_ids for the temple and date; returns the ids that were not already checked in."""
+        key = (temple_id, checkin_date)
+        with self._lock:
+            seen = self._dates.get(key)
+        if seen is None:
+            loaded = self._load(conn, temple_id, checkin_date)
+            with self._lock:
+                seen = self._dates.setdefault(key, loaded)
+                cutoff = date.today() - timedelta(days=self.keep_days)
+                for k in [k for k in self._dates if k[1] < cutoff]:
+                    del self._dates[k]
+        with self._lock:
+            fresh = set(booking_ids) - seen
+            seen |= fresh
+        return fresh
+
+    def release(self, temple_id, checkin_date, booking_ids):
+        with self._lock:
+            self._dates.get((temple_id, checkin_date), set()).difference_update(booking_ids)
+
+checkin_registry = CheckinRegistry()
+
+@app.route("/checkins/batch", methods=["POST"])
+def checkins_batch():
+    """
+    POST /checkins/batch
+    { "gate_id": "north-1", "device_id": "scanner-07",
+      "scans": [ {"ticket": "v1....", "scanned_at": "2025-11-28T06:12:03"}, {"booking_ref": "BK-..."} ] }
+    Accepts scans buffered by gate devices (including offline ones). Signed tickets are verified
+    without the DB; bare booking_refs are resolved with one IN query, and the paid/expired state
+    of every resolved booking is read with one more. Each scan gets a status: accepted, duplicate,
+    unknown, invalid, wrong_date, unpaid or expired. scanned_at must fall within
+    CHECKIN_OFFLINE_GRACE seconds of server time, and ticket expiry is judged against server time
+    with the same allowance, so a backdated scan cannot revive an old ticket. Accepted scans are
+    stored with multi-row inserts; rows another worker already stored are reported as duplicate.
+    """
+    conn = None
+    try:
+        data = request.get_json(force=True)
+        if not data or not isinstance(data.get("scans"), list):
+            return jsonify({"error": "JSON body with a 'scans' list required"}), 400
+        gate_id = data.get("gate_id")
+        device_id = data.get("device_id")
+        scans = data["scans"]
+        temple_id = current_temple_id()
+        server_now = datetime.datetime.now()
+        earliest = server_now - timedelta(seconds=CHECKIN_OFFLINE_GRACE)
+        latest = server_now + timedelta(seconds=CHECKIN_CLOCK_SKEW)
+
+        results = [None] * len(scans)
+        resolved = []  # (index, booking_id, booking_ref, booking_date, scanned_at)
+        refs_to_lookup = {}
+        for idx, scan in enumerate(scans):
+            if not isinstance(scan, dict):
+                results[idx] = {"status": "invalid", "error": "scan must be an object"}
+                continue
+            try:
+                scanned_at = datetime.datetime.fromisoformat(scan["scanned_at"]) if scan.get("scanned_at") else server_now
+            except (TypeError, ValueError):
+                results[idx] = {"status": "invalid", "error": "scanned_at must be ISO-8601"}
+                continue
+            if scanned_at.tzinfo is not None:
+                scanned_at = scanned_at.astimezone().replace(tzinfo=None)
+            if not earliest <= scanned_at <= latest:
+                results[idx] = {"status": "invalid", "error": "scanned_at is outside the offline upload window"}
+                continue
+            if scan.get("ticket"):
+                if not qr_keys:
+                    results[idx] = {"status": "invalid", "error": "Ticket check-in is not configured"}
+                    continue
+                try:
+                    claims = verify_ticket(scan["ticket"], qr_keys, now=earliest.timestamp())
+                except InvalidTicket as e:
+                    results[idx] = {"status": "invalid", "error": str(e)}
+                    continue
+                if claims.get("t", DEFAULT_TEMPLE_ID) != temple_id:
+                    results[idx] = {"status": "invalid", "error": "Ticket is for another temple"}
+                    continue
+                resolved.append((idx, claims["i"], claims["r"], claims["d"], scanned_at))
+            elif scan.get("booking_ref"):
+                if not isinstance(scan["booking_ref"], str):
+                    results[idx] = {"status": "invalid", "error": "booking_ref must be a string"}
+                    continue
+                refs_to_lookup.setdefault(scan["booking_ref"], []).append((idx, scanned_at))
+            else:
+                results[idx] = {"status": "invalid", "error": "ticket or booking_ref required"}
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database not connected"}), 500
+        cursor = conn.cursor()
+        if refs_to_lookup:
+            refs = list(refs_to_lookup)
+            placeholders = ",".join(["%s"] * len(refs))
+            cursor.execute(
+                f"SELECT id, booking_ref, booking_date FROM bookings WHERE booking_ref IN ({placeholders}) AND temple_id=%s",
+                refs + [temple_id]
+            )
+            found = {r[1]: (r[0], r[2].isoformat()) for r in cursor.fetchall()}
+            for ref, hits in refs_to_lookup.items():
+                for idx, scanned_at in hits:
+                    if ref in found:
+                        resolved.append((idx, found[ref][0], ref, found[ref][1], scanned_at))
+                    else:
+                        results[idx] = {"status": "unknown", "booking_ref": ref}
+
+        # Paid/expired state comes from the DB: a ticket's "p" claim is only a snapshot from when the
+        # QR was issued, and user-039's sweeper may have released the hold since
+        states = {}
+        booking_ids = list({r[1] for r in resolved})
+        if booking_ids:
+            placeholders = ",".join(["%s"] * len(booking_ids))
+            cursor.execute(
+                f"SELECT id, paid, expired_at FROM bookings WHERE id IN ({placeholders}) AND temple_id=%s",
+                booking_ids + [temple_id]
+            )
+            states = {r[0]: (bool(r[1]), r[2]) for r in cursor.fetchall()}
+
+        by_date = {}
+        for idx, booking_id, booking_ref, booking_date, scanned_at in resolved:
+            state = states.get(booking_id)
+            if state is None:
+                results[idx] = {"status": "unknown", "booking_ref": booking_ref}
+                continue
+            paid, expired_at = state
+            if not paid:
+                results[idx] = {"status": "expired" if expired_at else "unpaid", "booking_ref": booking_ref}
+                continue
+            if booking_date != scanned_at.date().isoformat():
+                results[idx] = {"status": "wrong_date", "booking_ref": booking_ref, "booking_date": booking_date}
+                continue
+            by_date.setdefault(scanned_at.date(), []).append((idx, booking_id, booking_ref, scanned_at))
+
+        upload_id = uuid.uuid4().hex
+        rows = []
+        row_results = {}  # (checkin_date, booking_id) -> index of the scan that claimed it
+        claimed = {}
+        for checkin_date, items in by_date.items():
+            fresh = checkin_registry.claim(conn, temple_id, checkin_date, [i[1] for i in items])
+            claimed[checkin_date] = fresh
+            pending = set(fresh)
+            for idx, booking_id, booking_ref, scanned_at in items:
+                if booking_id in pending:
+                    rows.append((temple_id, booking_id, booking_ref, checkin_date, scanned_at, gate_id, device_id, upload_id))
+                    row_results[(checkin_date, booking_id)] = idx
+                    pending.discard(booking_id)
+                    results[idx] = {"status": "accepted", "booking_ref": booking_ref}
+                else:
+                    results[idx] = {"status": "duplicate", "booking_ref": booking_ref}
+
+        try:
+            inserted = 0
+            for start in range(0, len(rows), CHECKIN_INSERT_CHUNK):
+                chunk = rows[start:start + CHECKIN_INSERT_CHUNK]
+                values = ",".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+                cursor.execute(
+                    "INSERT IGNORE INTO checkins (temple_id, booking_id, booking_ref, checkin_date, scanned_at, gate_id, device_id, upload_id) "
+                    f"VALUES {values}",
+                    [v for row in chunk for v in row]
+                )
+                inserted += cursor.rowcount
+            if inserted < len(rows):
+                # Another worker stored some of these first; the UNIQUE key dropped ours
+                cursor.execute("SELECT checkin_date, booking_id FROM checkins WHERE upload_id=%s", (upload_id,))
+                ours = {(r[0], r[1]) for r in cursor.fetchall()}
+                for key, idx in row_results.items():
+                    if key not in ours:
+                        results[idx]["status"] = "duplicate"
+            conn.commit()
+        except Error:
+            for checkin_date, fresh in claimed.items():
+                checkin_registry.release(temple_id, checkin_date, fresh)
+            raise
+        cursor.close()
+        conn.close()
+
+        summary = {}
+        for r in results:
+            summary[r["status"]] = summary.get(r["status"], 0) + 1
+        return jsonify({"success": True, "received": len(scans), "summary": summary, "results": results}), 200
+    except Error as e:
+        print(f"❌ Check-in DB error: {e}")
+        try:
+            if conn:
+                conn.rollback()
+        except:
+            pass
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    except Exception as e:
+        print(f"❌ Check-in error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.cli.command("bench-checkins")
+@click.option("--bookings", default=20000, show_default=True, help="Paid bookings seeded for today.")
+@click.option("--batch-size", default=500, show_default=True, help="Scans per /checkins/batch upload.")
+@click.option("--workers", default=8, show_default=True, help="Concurrent uploading gate devices.")
+def bench_checkins_command(bookings, batch_size, workers):
+    """
+    Measure /checkins/batch throughput: seeds paid bookings for today under a throwaway temple,
+    then `workers` threads upload every booking once (half as signed tickets when QR keys are
+    configured, half as bare booking_refs) plus ~5% repeat scans, through the real route.
+    Prints scans/s and per-upload latency, then removes the data.
+    """
+    temple_id = f"bench-{uuid.uuid4().hex[:6]}"
+    conn = get_db_connection(shard_for_temple(temple_id))
+    if not conn:
+        raise SystemExit(1)
+    cursor = conn.cursor()
+    today = date.today()
+    t0 = time.perf_counter()
+    refs = [f"BENCH-{temple_id}-{i}" for i in range(bookings)]
+    for start in range(0, bookings, CHECKIN_INSERT_CHUNK):
+        cursor.executemany('''
+            INSERT INTO bookings (temple_id, booking_ref, title, booking_date, time_slot, persons, amount, paid)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ''', [(temple_id, ref, "Bench darshan", today, "06:00 AM - 08:00 AM", 1, 100, True)
+              for ref in refs[start:start + CHECKIN_INSERT_CHUNK]])
+    conn.commit()
+    cursor.execute("SELECT id, booking_ref FROM bookings WHERE temple_id = %s", (temple_id,))
+    ids = {ref: booking_id for booking_id, ref in cursor.fetchall()}
+    print(f"seeded {bookings} paid bookings in {time.perf_counter() - t0:.2f}s")
+
+    scanned_at = datetime.datetime.now().isoformat(timespec="seconds")
+    scans = []
+    for i, ref in enumerate(refs):
+        if qr_keys and i % 2 == 0:
+            claims = ticket_claims({"id": ids[ref], "booking_ref": ref, "booking_date": today, "time_slot": "06:00 AM - 08:00 AM",
+                                    "persons": 1, "paid": True, "temple_id": temple_id})
+            scans.append({"ticket": sign_ticket(claims, qr_keys, qr_active_kid), "scanned_at": scanned_at})
+        else:
+            scans.append({"booking_ref": ref, "scanned_at": scanned_at})
+    scans += random.sample(scans, len(scans) // 20)
+    random.shuffle(scans)
+    uploads = [scans[i:i + batch_size] for i in range(0, len(scans), batch_size)]
+
+    def upload(chunk):
+        with app.test_client() as client:
+            start = time.perf_counter()
+            resp = client.post("/checkins/batch", headers={"X-Temple-Id": temple_id},
+                               json={"gate_id": "bench", "device_id": f"bench-{threading.get_ident()}", "scans": chunk})
+            return time.perf_counter() - start, resp.status_code, (resp.get_json() or {}).get("summary", {})
+
+    try:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(upload, uploads))
+        elapsed = time.perf_counter() - t0
+        latencies = sorted(r[0] * 1000 for r in results)
+        summary = {}
+        for _, status, counts in results:
+            if status != 200:
+                summary[f"http_{status}"] = summary.get(f"http_{status}", 0) + 1
+            for k, v in counts.items():
+                summary[k] = summary.get(k, 0) + v
+        print(f"{len(scans)} scans in {len(uploads)} uploads of {batch_size} over {workers} workers: "
+              f"{elapsed:.2f}s ({len(scans) / elapsed:,.0f} scans/s)")
+        print(f"  upload latency p50={latencies[len(latencies) // 2]:.1f}ms p95={latencies[int(len(latencies) * 0.95)]:.1f}ms")
+        print(f"  outcomes: {summary}")
+    finally:
+        checkin_registry.release(temple_id, today, ids.values())
+        cursor.execute("DELETE FROM checkins WHERE temple_id = %s", (temple_id,))
+        cursor.execute("DELETE FROM bookings WHERE temple_id = %s", (temple_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+# ---------- MULTI-TEMPLE ----------
+def fan_out_shards(fn):
+    """Run fn(shard, conn) on every shard in parallel. Returns ({shard: result}, {shard: error})."""
+    def run(shard):
+        conn = get_db_connection(shard)
+        if not conn:
+            raise RuntimeError("Database not connected")
+        try:
+            return fn(shard, conn)
+        finally:
+            conn.close()
+
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=len(db_shards)) as ex:
+        futures = {shard: ex.submit(run, shard) for shard in db_shards}
+        for shard, fut in futures.items():
+            try:
+                results[shard] = fut.result()
+            except Exception as e:
+                print(f"❌ Shard {shard} fan-out error: {e}")
+                errors[shard] = str(e)
+    return results, errors
+
+def list_temples():
+    """Configured temples plus every temple_id that has bookings on any shard."""
+    def distinct_temples(shard, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT temple_id FROM bookings")
+        rows = [r[0] for r in cursor.fetchall()]
+        cursor.close()
+        return rows
+
+    results, _ = fan_out_shards(distinct_temples)
+    temples = set(temple_shards)
+    for rows in results.values():
+        temples.update(rows)
+    return sorted(temples) or [DEFAULT_TEMPLE_ID]
+
+@app.route("/admin/temples/summary", methods=["GET"])
+def admin_temples_summary():
+    """
+    GET /admin/temples/summary?date=2025-11-28
+    Cross-temple view: queries every shard in parallel and merges per-temple booking,
+    person, paid and revenue totals. Shards that fail are listed under errors.
+    """
+    try:
+        date_str = request.args.get("date") or date.today().isoformat()
+        try:
+            datetime.datetime.strptime(date_str, "%Y-%m-%d")
+        except Exception:
+            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+
+        def per_temple(shard, conn):
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT temple_id,
+                       COUNT(*) AS bookings,
+                       COALESCE(SUM(persons), 0) AS persons,
+                       COALESCE(SUM(paid = TRUE), 0) AS paid_bookings,
+                       COALESCE(SUM(CASE WHEN paid = TRUE THEN amount ELSE 0 END), 0) AS revenue
+                FROM bookings
+                WHERE booking_date = %s AND expired_at IS NULL
+                GROUP BY temple_id
+            ''', (date_str,))
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+
+        results, errors = fan_out_shards(per_temple)
+        fields = ("bookings", "persons", "paid_bookings", "revenue")
+        temples = {}
+        for shard, rows in results.items():
+            for r in rows:
+                t = temples.setdefault(r["temple_id"], {"temple_id": r["temple_id"], "shard": shard, **{f: 0 for f in fields}})
+                for f in fields:
+                    t[f] += int(r[f])
+        totals = {f: sum(t[f] for t in temples.values()) for f in fields}
+        return jsonify({
+            "status": "partial" if errors else "success",
+            "date": date_str,
+            "temples": sorted(temples.values(), key=lambda t: t["temple_id"]),
+            "totals": totals,
+            "errors": errors
+        }), 200
+    except Exception as e:
+        print(f"❌ Temples summary error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
     
+# ---------- PAYMENT RECONCILIATION ----------
+RECONCILE_CHUNK = 1000
+RECONCILE_REPORT_LIMIT = 500
+
+RECONCILE_MAX_AMOUNT = 2 ** 31 - 1  # bookings.amount is a signed INT
+RECONCILE_MAX_REF = {"booking_ref": 50, "payment_ref": 255}  # settlement_staging column widths
+
+def parse_settlement_amount(raw):
+    """Return (amount, None) for a whole, finite, in-range rupee amount, else (None, error)."""
+    try:
+        value = Decimal((raw or "").strip())
+    except InvalidOperation:
+        return None, "amount must be a number"
+    if not value.is_finite():
+        return None, "amount must be finite"
+    if value != value.to_integral_value():
+        return None, "amount must be a whole number of rupees"
+    if not 0 <= value <= RECONCILE_MAX_AMOUNT:
+        return None, "amount is out of range"
+    return int(value), None
+
+def reconcile_settlements(csv_stream, temple_id=DEFAULT_TEMPLE_ID):
+    """
+    Reconcile a gateway settlement CSV (columns: booking_ref and/or payment_ref, amount) against
+    bookings. Rows are streamed into settlement_staging with multi-row inserts, matched with
+    set-wise UPDATE ... JOINs (booking_ref first, then payment_ref), and every matching unpaid
+    booking whose amount agrees is marked paid - together with its payment notification - in
+    one transaction. That transaction locks the matched bookings first and re-checks them, so a
+    /payment or expiry that landed after matching downgrades the row instead of notifying twice.
+    Returns counts, phase timings and samples of mismatched/unknown rows.
+    """
+    conn = get_db_connection(shard_for_temple(temple_id))
+    if not conn:
+        return None
+    batch_id = uuid.uuid4().hex
+    timings = {}
+    invalid_rows = []
+    loaded = 0
+    try:
+        cursor = conn.cursor(dictionary=True)
+        t0 = time.perf_counter()
+        reader = csv.DictReader(csv_stream)
+        reader.fieldnames = [(f or "").strip().lower() for f in (reader.fieldnames or [])]
+        chunk = []
+        for row_no, row in enumerate(reader, start=2):
+            booking_ref = (row.get("booking_ref") or "").strip() or None
+            payment_ref = (row.get("payment_ref") or "").strip() or None
+            amount, error = parse_settlement_amount(row.get("amount"))
+            if error is None and not (booking_ref or payment_ref):
+                error = "booking_ref or payment_ref is required"
+            for column, value in (("booking_ref", booking_ref), ("payment_ref", payment_ref)):
+                if error is None and value and len(value) > RECONCILE_MAX_REF[column]:
+                    error = f"{column} is longer than {RECONCILE_MAX_REF[column]} characters"
+            if error is not None:
+                if len(invalid_rows) < RECONCILE_REPORT_LIMIT:
+                    invalid_rows.append({"row": row_no, "error": error})
+                continue
+            chunk.append((batch_id, row_no, booking_ref, payment_ref, amount))
+            if len(chunk) >= RECONCILE_CHUNK:
+                cursor.executemany('''
+                    INSERT INTO settlement_staging (batch_id, row_no, booking_ref, payment_ref, amount)
+                    VALUES (%s, %s, %s, %s, %s)
+                ''', chunk)
+                loaded += len(chunk)
+                chunk = []
+        if chunk:
+            cursor.executemany('''
+                INSERT INTO settlement_staging (batch_id, row_no, booking_ref, payment_ref, amount)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', chunk)
+            loaded += len(chunk)
+        conn.commit()
+        timings["load_s"] = round(time.perf_counter() - t0, 3)
+
+        t0 = time.perf_counter()
+        cursor.execute('''
+            UPDATE settlement_staging s
+            JOIN bookings b ON b.booking_ref = s.booking_ref AND b.temple_id = %s
+            SET s.booking_id = b.id
+            WHERE s.batch_id = %s AND s.booking_ref IS NOT NULL
+        ''', (temple_id, batch_id))
+        cursor.execute('''
+            UPDATE settlement_staging s
+            JOIN bookings b ON b.payment_ref = s.payment_ref AND b.temple_id = %s
+            SET s.booking_id = b.id
+            WHERE s.batch_id = %s AND s.booking_id IS NULL AND s.payment_ref IS NOT NULL
+        ''', (temple_id, batch_id))
+        cursor.execute('''
+            UPDATE settlement_staging s
+            LEFT JOIN bookings b ON b.id = s.booking_id
+            SET s.outcome = CASE
+                WHEN b.id IS NULL THEN 'unknown'
+                WHEN b.paid = TRUE THEN 'already_paid'
+                WHEN b.expired_at IS NOT NULL THEN 'expired'
+                WHEN b.amount <> s.amount THEN 'amount_mismatch'
+                ELSE 'applied' END
+            WHERE s.batch_id = %s
+        ''', (batch_id,))
+        # Several settlement rows for one booking: only the first one is applied
+        cursor.execute('''
+            UPDATE settlement_staging s
+            JOIN (SELECT booking_id, MIN(row_no) AS first_row FROM settlement_staging
+                  WHERE batch_id = %s AND outcome = 'applied' GROUP BY booking_id) f
+              ON f.booking_id = s.booking_id
+            SET s.outcome = 'duplicate'
+            WHERE s.batch_id = %s AND s.outcome = 'applied' AND s.row_no <> f.first_row
+        ''', (batch_id, batch_id))
+        timings["match_s"] = round(time.perf_counter() - t0, 3)
+
+        t0 = time.perf_counter()
+        cursor.execute('''
+            SELECT b.id FROM bookings b
+            JOIN settlement_staging s ON s.booking_id = b.id
+            WHERE s.batch_id = %s AND s.outcome = 'applied'
+            FOR UPDATE
+        ''', (batch_id,))
+        cursor.fetchall()
+        cursor.execute('''
+            UPDATE settlement_staging s
+            JOIN bookings b ON b.id = s.booking_id
+            SET s.outcome = IF(b.paid = TRUE, 'already_paid', 'expired')
+            WHERE s.batch_id = %s AND s.outcome = 'applied' AND (b.paid = TRUE OR b.expired_at IS NOT NULL)
+        ''', (batch_id,))
+        cursor.execute('''
+            UPDATE bookings b
+            JOIN settlement_staging s ON s.booking_id = b.id
+            SET b.paid = TRUE, b.payment_ref = COALESCE(s.payment_ref, b.payment_ref)
+            WHERE s.batch_id = %s AND s.outcome = 'applied' AND b.paid = FALSE AND b.expired_at IS NULL
+        ''', (batch_id,))
+        applied = cursor.rowcount
+        cursor.execute('''
+            INSERT INTO notifications (temple_id, title, message, type, booking_id)
+            SELECT b.temple_id, 'Booking Payment Successful',
+                   CONCAT('Payment for booking Ref ', b.booking_ref, ' is successful. Amount: ₹', s.amount, '.'),
+                   'payment_success', b.id
+            FROM settlement_staging s
+            JOIN bookings b ON b.id = s.booking_id
+            WHERE s.batch_id = %s AND s.outcome = 'applied'
+        ''', (batch_id,))
+        conn.commit()
+        timings["apply_s"] = round(time.perf_counter() - t0, 3)
+
+        cursor.execute('''
+            SELECT outcome, COUNT(*) AS n FROM settlement_staging WHERE batch_id = %s GROUP BY outcome
+        ''', (batch_id,))
+        counts = {r["outcome"]: int(r["n"]) for r in cursor.fetchall()}
+        cursor.execute('''
+            SELECT s.row_no, s.booking_ref, s.payment_ref, s.amount AS settled_amount, b.amount AS booking_amount
+            FROM settlement_staging s JOIN bookings b ON b.id = s.booking_id
+            WHERE s.batch_id = %s AND s.outcome = 'amount_mismatch'
+            ORDER BY s.row_no LIMIT %s
+        ''', (batch_id, RECONCILE_REPORT_LIMIT))
+        mismatched = cursor.fetchall()
+        cursor.execute('''
+            SELECT row_no, booking_ref, payment_ref, amount FROM settlement_staging
+            WHERE batch_id = %s AND outcome = 'unknown'
+            ORDER BY row_no LIMIT %s
+        ''', (batch_id, RECONCILE_REPORT_LIMIT))
+        unknown = cursor.fetchall()
+        cursor.execute("DELETE FROM settlement_staging WHERE batch_id = %s", (batch_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+        admin_summary_cache.clear()
+        return {
+            "rows_loaded": loaded,
+            "applied": applied,
+            "counts": counts,
+            "invalid_rows": invalid_rows,
+            "amount_mismatches": mismatched,
+            "unknown_refs": unknown,
+            "timings": timings
+        }
+    except Exception as e:
+        # Roll back, drop this run's staging rows and close on any failure, not just DB errors
+        print(f"❌ Reconciliation error: {e}")
+        try:
+            conn.rollback()
+            cleanup = conn.cursor()
+            cleanup.execute("DELETE FROM settlement_staging WHERE batch_id = %s", (batch_id,))
+            conn.commit()
+            cleanup.close()
+            conn.close()
+        except:
+            pass
+        raise
+
+@app.route("/admin/payments/reconcile", methods=["POST"])
+def reconcile_payments():
+    """
+    POST /admin/payments/reconcile   (multipart 'file' field, or a raw text/csv body)
+    Streams the settlement CSV into the reconciliation pipeline and returns its report.
+    """
+    try:
+        upload = request.files.get("file")
+        stream = upload.stream if upload else request.stream
+        report = reconcile_settlements(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""), current_temple_id())
+        if report is None:
+            return jsonify({"error": "Database not connected"}), 500
+        return jsonify({"success": True, **report}), 200
+    except Error as e:
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    except Exception as e:
+        print(f"❌ Reconcile route error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.cli.command("reconcile-payments")
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--temple-id", default=DEFAULT_TEMPLE_ID, show_default=True)
+def reconcile_payments_command(csv_path, temple_id):
+    """Reconcile a gateway settlement CSV against bookings."""
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        report = reconcile_settlements(f, temple_id)
+    if report is None:
+        raise SystemExit(1)
+    print(json.dumps(report, indent=2))
+
+@app.cli.command("bench-reconcile")
+@click.option("--rows", default=100000, show_default=True)
+def bench_reconcile_command(rows):
+    """
+    Benchmark reconciliation: seeds `rows` unpaid bookings under a throwaway temple, reconciles
+    a CSV where ~1% of amounts mismatch and ~1% of refs are unknown, then removes the data.
+    """
+    temple_id = f"bench-{uuid.uuid4().hex[:6]}"
+    conn = get_db_connection(shard_for_temple(temple_id))
+    if not conn:
+        raise SystemExit(1)
+    cursor = conn.cursor()
+    t0 = time.perf_counter()
+    refs = [f"BENCH-{temple_id}-{i}" for i in range(rows)]
+    for start in range(0, rows, RECONCILE_CHUNK):
+        cursor.executemany('''
+            INSERT INTO bookings (temple_id, booking_ref, title, booking_date, time_slot, persons, amount, paid)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ''', [(temple_id, ref, "Bench darshan", date.today(), "06:00 AM - 08:00 AM", 1, 100, False)
+              for ref in refs[start:start + RECONCILE_CHUNK]])
+    conn.commit()
+    print(f"seeded {rows} bookings in {time.perf_counter() - t0:.2f}s")
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["booking_ref", "payment_ref", "amount"])
+    for i, ref in enumerate(refs):
+        if i % 100 == 1:
+            ref = f"UNKNOWN-{i}"
+        writer.writerow([ref, f"PAY-{temple_id}-{i}", 150 if i % 100 == 0 else 100])
+    buf.seek(0)
+
+    try:
+        t0 = time.perf_counter()
+        report = reconcile_settlements(buf, temple_id)
+        elapsed = time.perf_counter() - t0
+        print(f"reconciled {report['rows_loaded']} rows in {elapsed:.2f}s ({report['rows_loaded'] / elapsed:,.0f} rows/s)")
+        print(f"  phases: {report['timings']}")
+        print(f"  outcomes: {report['counts']}")
+    finally:
+        cursor.execute("DELETE FROM notifications WHERE temple_id = %s", (temple_id,))
+        cursor.execute("DELETE FROM bookings WHERE temple_id = %s", (temple_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+# ---------- EXPIRY SWEEPER ----------
+BOOKING_HOLD_MINUTES = int(os.environ.get("BOOKING_HOLD_MINUTES", 30))
+BOOKING_SWEEP_INTERVAL = int(os.environ.get("BOOKING_SWEEP_INTERVAL", 0))  # seconds; 0 = run via CLI/cron only
+
+class SweeperMetrics:
+    """Per-shard counters for the expiry sweeper, shared by the background thread and the CLI."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shards = {}
+
+    def record(self, shard, stats, duration, error=None):
+        with self._lock:
+            m = self._shards.setdefault(shard, {"runs": 0, "expired_total": 0, "batches_total": 0, "errors": 0})
+            m["runs"] += 1
+            m["last_run_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+            m["last_duration_s"] = round(duration, 3)
+            if error is not None:
+                m["errors"] += 1
+                m["last_error"] = error
+                return
+            m["expired_total"] += stats["expired"]
+            m["batches_total"] += stats["batches"]
+            m["last_expired"] = stats["expired"]
+            m["last_throughput_per_s"] = round(stats["expired"] / duration, 1) if duration > 0 else None
+
+    def snapshot(self):
+        with self._lock:
+            return {shard: dict(m) for shard, m in self._shards.items()}
+
+sweeper_metrics = SweeperMetrics()
+
+def expire_unpaid_bookings(hold_minutes=BOOKING_HOLD_MINUTES, batch_size=200, sleep_ms=100, max_batches=None, shard=DEFAULT_SHARD):
+    """
+    Release unpaid bookings created more than hold_minutes ago: stamp expired_at and add one
+    'booking_expired' notification per booking with a single INSERT ... SELECT. Batches are
+    picked oldest-first through idx_bookings_unpaid_hold with FOR UPDATE SKIP LOCKED, so rows
+    a /payment call is holding are skipped, and each batch commits before the job sleeps.
+    Expired bookings drop out of capacity counts, /history and the admin summaries.
+    """
+    conn = get_db_connection(shard)
+    if not conn:
+        print("❌ Cannot sweep bookings - no database connection")
+        return None
+    stats = {"expired": 0, "batches": 0}
+    try:
+        cursor = conn.cursor()
+        while max_batches is None or stats["batches"] < max_batches:
+            cursor.execute('''
+                SELECT id, temple_id, booking_date FROM bookings
+                WHERE paid = FALSE AND expired_at IS NULL AND created_at < NOW() - INTERVAL %s MINUTE
+                ORDER BY paid, expired_at, created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (hold_minutes, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                conn.rollback()
+                break
+            ids = [r[0] for r in rows]
+            placeholders = ",".join(["%s"] * len(ids))
+            cursor.execute(f"UPDATE bookings SET expired_at = NOW() WHERE id IN ({placeholders})", ids)
+            cursor.execute(f'''
+                INSERT INTO notifications (temple_id, title, message, type, booking_id)
+                SELECT temple_id, 'Booking Expired',
+                       CONCAT('Booking Ref ', booking_ref, ' was released because payment was not completed within {int(hold_minutes)} minutes.'),
+                       'booking_expired', id
+                FROM bookings WHERE id IN ({placeholders})
+            ''', ids)
+            conn.commit()
+            for temple_id, booking_date in {(r[1], str(r[2])) for r in rows}:
+                admin_summary_cache.invalidate((temple_id, booking_date))
+            stats["expired"] += len(ids)
+            stats["batches"] += 1
+            if len(ids) < batch_size:
+                break
+            time.sleep(sleep_ms / 1000.0)
+        cursor.close()
+        conn.close()
+        return stats
+    except Error as e:
+        print(f"❌ Expiry sweep error: {e}")
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        raise
+
+def run_expiry_sweep(**kwargs):
+    """One sweep over every shard; results go to sweeper_metrics. Returns {shard: stats or None}."""
+    results = {}
+    for shard in db_shards:
+        start = time.perf_counter()
+        try:
+            stats = expire_unpaid_bookings(shard=shard, **kwargs)
+        except Error as e:
+            sweeper_metrics.record(shard, None, time.perf_counter() - start, error=str(e))
+            results[shard] = None
+            continue
+        if stats is None:
+            sweeper_metrics.record(shard, None, time.perf_counter() - start, error="Database not connected")
+        else:
+            sweeper_metrics.record(shard, stats, time.perf_counter() - start)
+        results[shard] = stats
+    return results
+
+def start_expiry_sweeper(interval=BOOKING_SWEEP_INTERVAL):
+    """Run run_expiry_sweep every `interval` seconds on a daemon thread (no-op when interval <= 0)."""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                run_expiry_sweep()
+            except Exception as e:
+                print(f"❌ Expiry sweeper error: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="expiry-sweeper", daemon=True)
+    thread.start()
+    print(f"🧹 Expiry sweeper running every {interval}s (hold {BOOKING_HOLD_MINUTES} min)")
+    return thread
+
+@app.cli.command("expire-bookings")
+@click.option("--hold-minutes", default=BOOKING_HOLD_MINUTES, show_default=True, help="Unpaid bookings older than this are released.")
+@click.option("--batch-size", default=200, show_default=True)
+@click.option("--sleep-ms", default=100, show_default=True, help="Pause between batches.")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches per shard.")
+@click.option("--interval", default=0, show_default=True, help="Keep sweeping every N seconds (0 = single pass).")
+def expire_bookings_command(hold_minutes, batch_size, sleep_ms, max_batches, interval):
+    """Expire unpaid bookings past their hold on every shard."""
+    while True:
+        results = run_expiry_sweep(hold_minutes=hold_minutes, batch_size=batch_size, sleep_ms=sleep_ms, max_batches=max_batches)
+        for shard, stats in results.items():
+            if stats is not None:
+                print(f"✅ [{shard}] Expired {stats['expired']} bookings in {stats['batches']} batches")
+        if interval <= 0:
+            break
+        time.sleep(interval)
+    if any(stats is None for stats in results.values()):
+        raise SystemExit(1)
+
+@app.route("/stats/expiry-sweeper", methods=["GET"])
+def expiry_sweeper_stats():
+    """
+    Sweeper counters per shard plus live lag: how long the oldest overdue unpaid booking has
+    been waiting past its hold (0 when the sweeper is caught up) and how many are overdue.
+    """
+    def lag(shard, conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*), TIMESTAMPDIFF(SECOND, MIN(created_at), NOW() - INTERVAL %s MINUTE)
+            FROM bookings
+            WHERE paid = FALSE AND expired_at IS NULL AND created_at < NOW() - INTERVAL %s MINUTE
+        ''', (BOOKING_HOLD_MINUTES, BOOKING_HOLD_MINUTES))
+        overdue, lag_seconds = cursor.fetchone()
+        cursor.close()
+        return {"overdue_bookings": int(overdue), "lag_seconds": int(lag_seconds or 0)}
+
+    results, errors = fan_out_shards(lag)
+    metrics = sweeper_metrics.snapshot()
+    shards = {shard: {**metrics.get(shard, {}), **results.get(shard, {})} for shard in db_shards}
+    return jsonify({
+        "hold_minutes": BOOKING_HOLD_MINUTES,
+        "interval_seconds": BOOKING_SWEEP_INTERVAL,
+        "shards": shards,
+        "errors": errors
+    }), 200
+
+# ---------- BROADCAST NOTIFICATIONS ----------
+# notifications.recipient_id: NULL = admin feed (booking/payment events), 0 = broadcast to every
+# user of the temple (stored once), >0 = personal to that users.id. Broadcast reads are
+# per-user rows in notification_reads; personal ones use notifications.is_read.
+USER_FEED_QUERY = '''
+    SELECT n.id, n.title, n.message, n.type, n.booking_id, n.created_at,
+           n.recipient_id = 0 AS is_broadcast,
+           IF(n.recipient_id = 0, r.user_id IS NOT NULL, n.is_read) AS is_read,
+           (SELECT COUNT(*) FROM notifications WHERE temple_id = %(temple)s AND recipient_id = 0)
+         - (SELECT COUNT(*) FROM notification_reads rr JOIN notifications rb ON rb.id = rr.notification_id
+            WHERE rr.user_id = %(user)s AND rb.temple_id = %(temple)s AND rb.recipient_id = 0)
+         + (SELECT COUNT(*) FROM notifications
+            WHERE temple_id = %(temple)s AND recipient_id = %(user)s AND is_read = FALSE) AS unread_count
+    FROM (
+        (SELECT id FROM notifications
+         WHERE temple_id = %(temple)s AND recipient_id = 0 AND id < %(before)s
+         ORDER BY id DESC LIMIT %(limit)s)
+        UNION ALL
+        (SELECT id FROM notifications
+         WHERE temple_id = %(temple)s AND recipient_id = %(user)s AND id < %(before)s
+         ORDER BY id DESC LIMIT %(limit)s)
+    ) feed
+    JOIN notifications n ON n.id = feed.id
+    LEFT JOIN notification_reads r ON r.user_id = %(user)s AND r.notification_id = n.id
+    ORDER BY n.id DESC
+    LIMIT %(limit)s
+'''
+
+def fetch_user_feed(cursor, temple_id, user_id, limit=50, before=None):
+    """
+    One statement for a user's feed page and unread count. Both branches of the UNION and all
+    three counts are range scans on idx_notifications_feed or the receipts primary key, so the
+    cost depends on the temple's broadcasts and the user's own rows, never on the user count.
+    Returns (rows, unread_count); unread_count is None for an empty page past the first.
+    """
+    cursor.execute(USER_FEED_QUERY, {
+        "temple": temple_id, "user": user_id, "limit": limit, "before": before or 2 ** 31 - 1
+    })
+    rows = cursor.fetchall()
+    if rows:
+        return rows, int(rows[0]["unread_count"])
+    return rows, (0 if before is None else None)
+
+@app.route("/notifications/feed", methods=["GET"])
+def notifications_feed():
+    """
+    GET /notifications/feed?user_id=12&limit=50&before=<id>
+    The user's merged broadcast + personal notifications, newest first, with per-user read state.
+    """
+    try:
+        user_id = request.args.get("user_id", type=int)
+        if not user_id or user_id <= 0:
+            return jsonify({"error": "user_id query parameter is required"}), 400
+        limit = max(1, min(request.args.get("limit", 50, type=int), 200))
+        before = request.args.get("before", type=int)
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database not connected"}), 500
+        cursor = conn.cursor(dictionary=True)
+        rows, unread = fetch_user_feed(cursor, current_temple_id(), user_id, limit, before)
+        cursor.close()
+        conn.close()
+        out = []
+        for row in rows:
+            item = serialize_row(row)
+            item.pop("unread_count", None)
+            item["is_broadcast"] = bool(item["is_broadcast"])
+            item["is_read"] = bool(item["is_read"])
+            out.append(item)
+        return jsonify({
+            "notifications": out,
+            "unread_count": unread,
+            "next_before": out[-1]["id"] if len(out) == limit else None
+        }), 200
+    except Error as e:
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    except Exception as e:
+        print(f"❌ Notification feed error: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route("/admin/notifications", methods=["POST"])
+def send_notification():
+    """
+    POST /admin/notifications  { "title", "message", "type"?, "user_id"? }
+    Without user_id the message is a temple-wide broadcast, stored as a single row.
+    """
+    data = request.get_json(silent=True) or {}
+    title = (data.get("title") or "").strip()
+    message = (data.get("message") or "").strip()
+    if not title or not message:
+        return jsonify({"error": "title and message are required"}), 400
+    user_id = data.get("user_id")
+    try:
+        recipient_id = int(user_id) if user_id is not None else 0
+    except (TypeError, ValueError):
+        return jsonify({"error": "user_id must be an integer"}), 400
+    if user_id is not None and recipient_id <= 0:
+        return jsonify({"error": "user_id must be positive"}), 400
+    ok = insert_notification(title, message, data.get("type") or ("broadcast" if recipient_id == 0 else "general"),
+                             recipient_id=recipient_id)
+    if not ok:
+        return jsonify({"error": "Could not save notification"}), 500
+    return jsonify({"success": True, "broadcast": recipient_id == 0}), 201
+
+@app.cli.command("bench-feed")
+@click.option("--users", default="1000,10000,50000", show_default=True, help="Comma-separated user counts to measure.")
+@click.option("--broadcasts", default=100, show_default=True)
+@click.option("--samples", default=200, show_default=True, help="Feed queries timed per user count.")
+def bench_feed_command(users, broadcasts, samples):
+    """
+    Show that feed + unread cost stays flat as users grow: under a throwaway temple, seed the
+    broadcasts once, then for each user count add personal notifications and receipts (each
+    user reads ~1/4 of the broadcasts) and time fetch_user_feed for random users.
+    """
+    temple_id = f"bench-{uuid.uuid4().hex[:6]}"
+    conn = get_db_connection(shard_for_temple(temple_id))
+    if not conn:
+        raise SystemExit(1)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.executemany(
+            "INSERT INTO notifications (temple_id, title, message, type, recipient_id) VALUES (%s, %s, %s, 'broadcast', 0)",
+            [(temple_id, f"Announcement {i}", "Temple announcement for all devotees") for i in range(broadcasts)]
+        )
+        conn.commit()
+        cursor.execute("SELECT id FROM notifications WHERE temple_id = %s AND recipient_id = 0", (temple_id,))
+        broadcast_ids = [r["id"] for r in cursor.fetchall()]
+        seeded = 0
+        for count in sorted(int(u) for u in users.split(",")):
+            t0 = time.perf_counter()
+            for start in range(seeded + 1, count + 1, 1000):
+                chunk = range(start, min(start + 1000, count + 1))
+                cursor.executemany(
+                    "INSERT INTO notifications (temple_id, title, message, type, recipient_id) VALUES (%s, %s, %s, 'general', %s)",
+                    [(temple_id, "Booking reminder", "Your darshan is tomorrow", u) for u in chunk for _ in range(2)]
+                )
+                cursor.executemany(
+                    "INSERT IGNORE INTO notification_reads (user_id, notification_id) VALUES (%s, %s)",
+                    [(u, nid) for u in chunk for nid in random.sample(broadcast_ids, len(broadcast_ids) // 4)]
+                )
+                conn.commit()
+            seeded = count
+            seed_s = time.perf_counter() - t0
+
+            timings = []
+            for _ in range(samples):
+                user_id = random.randint(1, count)
+                t0 = time.perf_counter()
+                fetch_user_feed(cursor, temple_id, user_id)
+                timings.append((time.perf_counter() - t0) * 1000)
+            timings.sort()
+            print(f"users={count:>8,}  seed={seed_s:6.1f}s  feed+unread p50={timings[len(timings) // 2]:6.2f}ms  "
+                  f"p95={timings[int(len(timings) * 0.95)]:6.2f}ms")
+    finally:
+        cursor.execute("DELETE r FROM notification_reads r JOIN notifications n ON n.id = r.notification_id WHERE n.temple_id = %s", (temple_id,))
+        cursor.execute("DELETE FROM notifications WHERE temple_id = %s", (temple_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
 if __name__ == "__main__":
     print("🚀 Starting Divya Drishti Flask server...")
     print("📍 DEVELOPMENT MODE: Dummy OTP Enabled")
     print("📍 Test server at: http://127.0.0.1:5000/")
     print("🔄 Setting up database tables...")
-    create_tables()
+    for shard in db_shards:
+        create_tables(shard)
+    start_expiry_sweeper()
     app.run(debug=True, host="0.0.0.0", port=5000)
     
\ No newline at end of file
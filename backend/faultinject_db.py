@@ -0,0 +1,141 @@
+# faultinject_db.py - simulate a MySQL stall and measure API latency through it
+#
+#   1. python faultinject_db.py --listen 3307 --mysql 127.0.0.1:3306      (starts the proxy + probes)
+#   2. DB_PORT=3307 python app.py                                          (in another shell, start within --warmup)
+#
+# The script forwards TCP traffic to MySQL, then "stalls" it for --outage seconds: existing
+# and new connections are held open but no bytes move, which is what a hung database looks
+# like to the app. Throughout, it polls GET endpoints and prints per-phase latency and status
+# counts. With the connect/read timeouts and circuit breaker in place, latency during the outage
+# stays bounded (fast 500s or stale 200s) instead of hanging until the workers run out.
+#
+# Exits non-zero when any outage-phase probe takes longer than --max-outage-ms or times out,
+# or when an endpoint that answered fresh in the healthy phase is still stale or failing at
+# the end of the recovery phase (i.e. the breaker never closed again).
+import argparse
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+stalled = threading.Event()
+
+def pump(src, dst):
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            while stalled.is_set():
+                time.sleep(0.05)
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for s in (src, dst):
+            try:
+                s.close()
+            except OSError:
+                pass
+
+def serve_proxy(listen_port, mysql_host, mysql_port):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", listen_port))
+    server.listen(128)
+    while True:
+        client, _ = server.accept()
+        try:
+            upstream = socket.create_connection((mysql_host, mysql_port))
+        except OSError:
+            client.close()
+            continue
+        threading.Thread(target=pump, args=(client, upstream), daemon=True).start()
+        threading.Thread(target=pump, args=(upstream, client), daemon=True).start()
+
+def probe(url, timeout):
+    t0 = time.monotonic()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            status = resp.status
+            if resp.headers.get("X-Cache") == "STALE":
+                status = "200-stale"
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = "timeout/error"
+    return status, time.monotonic() - t0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listen", type=int, default=3307)
+    parser.add_argument("--mysql", default="127.0.0.1:3306")
+    parser.add_argument("--api", default="http://127.0.0.1:5000")
+    parser.add_argument("--warmup", type=float, default=15.0)
+    parser.add_argument("--outage", type=float, default=30.0)
+    parser.add_argument("--recovery", type=float, default=20.0)
+    parser.add_argument("--client-timeout", type=float, default=30.0)
+    parser.add_argument("--max-outage-ms", type=float, default=10000.0,
+                        help="Latency bound for every probe during the outage: a stalled pooled connection "
+                             "costs DB_READ_TIMEOUT (ping) + DB_CONNECT_TIMEOUT (reconnect), plus headroom")
+    args = parser.parse_args()
+
+    host, port = args.mysql.split(":")
+    threading.Thread(target=serve_proxy, args=(args.listen, host, int(port)), daemon=True).start()
+    paths = ["/slots?days=7", "/stats/bookings-count?date=2025-12-09", "/notifications?limit=20", "/history"]
+
+    phases = [("healthy", args.warmup, False), ("outage", args.outage, True), ("recovery", args.recovery, False)]
+    results = {}
+    for name, duration, stall in phases:
+        if stall:
+            stalled.set()
+        else:
+            stalled.clear()
+        samples = {p: [] for p in paths}
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            threads = []
+            for p in paths:
+                def run(p=p):
+                    samples[p].append(probe(args.api + p, args.client_timeout))
+                th = threading.Thread(target=run)
+                th.start()
+                threads.append(th)
+            for th in threads:
+                th.join()
+            time.sleep(0.2)
+        results[name] = samples
+        print(f"== {name} ({duration:.0f}s, database {'stalled' if stall else 'reachable'})")
+        for p, rows in samples.items():
+            if not rows:
+                continue
+            lat = sorted(r[1] * 1000 for r in rows)
+            statuses = {}
+            for status, _ in rows:
+                statuses[status] = statuses.get(status, 0) + 1
+            print(f"  {p:45s} n={len(rows):4d} p50={lat[len(lat) // 2]:8.1f}ms "
+                  f"max={lat[-1]:8.1f}ms statuses={statuses}")
+
+    failures = []
+    for p, rows in results["outage"].items():
+        slow = [r for r in rows if r[0] == "timeout/error" or r[1] * 1000 > args.max_outage_ms]
+        if slow:
+            worst = max(r[1] for r in slow) * 1000
+            failures.append(f"{p}: {len(slow)} outage probes over {args.max_outage_ms:.0f}ms or timed out (worst {worst:.0f}ms)")
+    for p, rows in results["recovery"].items():
+        if 200 not in {r[0] for r in results["healthy"][p]}:
+            continue
+        tail = rows[len(rows) // 2:]
+        if not tail or tail[-1][0] != 200:
+            failures.append(f"{p}: not serving fresh 200s at the end of recovery (last status {tail[-1][0] if tail else None})")
+    if failures:
+        print("FAIL")
+        for f in failures:
+            print(f"  {f}")
+        sys.exit(1)
+    print("PASS")
+
+if __name__ == "__main__":
+    main()
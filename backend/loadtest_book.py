@@ -0,0 +1,99 @@
+# loadtest_book.py - overload /book on one date/slot and check admission control behaviour
+#
+#   python loadtest_book.py --url http://127.0.0.1:5000 --rate 5 --overload 10 --duration 20
+#
+# --rate must match the server's BOOK_RATE_PER_SLOT. Clients arrive at overload x rate per
+# second, honour Retry-After and retry with their queue_ticket. The report shows latency of the
+# admitted /book calls (the DB write path) per 5s window, and how many admitted clients
+# overtook an earlier ticket holder. Run it against a local dev database only.
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+def post_json(url, body):
+    req = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return resp.status, json.loads(resp.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--date", default="2030-01-14")
+    parser.add_argument("--slot", default="06:00 AM - 08:00 AM")
+    parser.add_argument("--rate", type=float, default=5.0)
+    parser.add_argument("--overload", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    args = parser.parse_args()
+
+    results = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    deadline = start + args.duration * 4
+
+    def client(n):
+        body = {
+            "title": "Load test darshan",
+            "date": args.date,
+            "time_slot": args.slot,
+            "persons": 1,
+            "person_details": [{"name": f"Load {n}", "phone": "9000000000", "gender": "Other", "age": "30"}],
+        }
+        first_ticket = None
+        attempts = 0
+        while time.monotonic() < deadline:
+            attempts += 1
+            t0 = time.monotonic()
+            status, data = post_json(args.url + "/book", body)
+            elapsed = time.monotonic() - t0
+            if status == 201:
+                with lock:
+                    results.append({"ticket": first_ticket, "admitted_at": time.monotonic() - start,
+                                    "latency": elapsed, "attempts": attempts})
+                return
+            if status in (429, 503):
+                if data.get("queue_ticket") is not None:
+                    body["queue_ticket"] = data["queue_ticket"]
+                    if first_ticket is None:
+                        first_ticket = data["queue_ticket"]
+                time.sleep(float(data.get("retry_after", 1)))
+                continue
+            print(f"client {n}: unexpected {status} {data}")
+            return
+
+    threads = []
+    total = int(args.rate * args.overload * args.duration)
+    interval = 1.0 / (args.rate * args.overload)
+    for n in range(total):
+        th = threading.Thread(target=client, args=(n,), daemon=True)
+        th.start()
+        threads.append(th)
+        time.sleep(interval)
+    for th in threads:
+        th.join(max(0.0, deadline - time.monotonic()) + 1)
+
+    print(f"clients: {total}  admitted: {len(results)}  offered load: {args.overload}x")
+    window = 5.0
+    for w in range(int(max((r["admitted_at"] for r in results), default=0) // window) + 1):
+        lat = [r["latency"] * 1000 for r in results if w * window <= r["admitted_at"] < (w + 1) * window]
+        if lat:
+            print(f"  {w * window:5.0f}s  n={len(lat):4d}  p50={percentile(lat, 50):7.1f}ms  "
+                  f"p95={percentile(lat, 95):7.1f}ms  p99={percentile(lat, 99):7.1f}ms")
+
+    queued = [r for r in sorted(results, key=lambda r: r["admitted_at"]) if r["ticket"] is not None]
+    overtakes = sum(1 for a, b in zip(queued, queued[1:]) if b["ticket"] < a["ticket"])
+    print(f"queued clients admitted: {len(queued)}  out-of-order admissions: {overtakes}")
+
+if __name__ == "__main__":
+    main()
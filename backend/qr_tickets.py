@@ -0,0 +1,122 @@
+# qr_tickets.py - compact HMAC-signed darshan tickets that gate devices verify offline
+#
+# Token format:  v1.<kid>.<base64url(payload json)>.<base64url(hmac-sha256)>
+# The MAC covers "v1.<kid>.<payload>". Keys come from QR_SIGNING_KEYS ("kid:secret,kid:secret");
+# QR_ACTIVE_KID picks the signing key. To rotate, add the new key, switch QR_ACTIVE_KID, and
+# drop the old key once every ticket signed with it has expired.
+# Without QR_SIGNING_KEYS no tickets are issued or accepted. DEV_KEYS is public (it is in this
+# repo), so it is only used when QR_ALLOW_DEV_KEY=1 is set explicitly for local development.
+#
+# Running this file directly prints a verifications-per-second benchmark.
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import time
+
+TOKEN_VERSION = "v1"
+DEV_KEYS = {"dev": b"divya-drishti-dev-qr-key"}
+REQUIRED_CLAIMS = {"i", "r", "d", "s", "n", "p"}
+
+class InvalidTicket(ValueError):
+    pass
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def load_keys_from_env():
+    """
+    Return ({kid: secret_bytes}, active_kid). When QR_SIGNING_KEYS is unset this is ({}, None) -
+    tickets disabled - unless QR_ALLOW_DEV_KEY=1 opts into the public development key.
+    """
+    raw = os.environ.get("QR_SIGNING_KEYS", "")
+    keys = {}
+    for part in raw.split(","):
+        if ":" in part:
+            kid, secret = part.split(":", 1)
+            keys[kid.strip()] = secret.strip().encode("utf-8")
+    if not keys:
+        if os.environ.get("QR_ALLOW_DEV_KEY") != "1":
+            print("⚠️ QR_SIGNING_KEYS not set - signed tickets are disabled (QR_ALLOW_DEV_KEY=1 for local dev)")
+            return {}, None
+        print("⚠️ QR_SIGNING_KEYS not set - signing tickets with the PUBLIC development key (QR_ALLOW_DEV_KEY=1)")
+        keys = dict(DEV_KEYS)
+    active = os.environ.get("QR_ACTIVE_KID") or next(iter(keys))
+    if active not in keys:
+        raise ValueError(f"QR_ACTIVE_KID '{active}' is not in QR_SIGNING_KEYS")
+    return keys, active
+
+def ticket_claims(booking: dict):
+    """Compact claims for a booking row: ref, date, slot, persons, paid, temple, expiry (end of darshan day)."""
+    booking_date = booking["booking_date"]
+    if isinstance(booking_date, str):
+        booking_date = datetime.date.fromisoformat(booking_date)
+    expires = datetime.datetime.combine(booking_date + datetime.timedelta(days=1), datetime.time())
+    claims = {
+        "i": int(booking["id"]),
+        "r": booking["booking_ref"],
+        "d": booking_date.isoformat(),
+        "s": booking["time_slot"],
+        "n": int(booking["persons"]),
+        "p": 1 if booking.get("paid") else 0,
+        "exp": int(expires.timestamp()),
+    }
+    if booking.get("temple_id"):
+        claims["t"] = booking["temple_id"]
+    return claims
+
+def sign_ticket(claims: dict, keys: dict, kid: str) -> str:
+    body = _b64encode(json.dumps(claims, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+    signing_input = f"{TOKEN_VERSION}.{kid}.{body}"
+    mac = hmac.new(keys[kid], signing_input.encode("ascii"), hashlib.sha256).digest()
+    return f"{signing_input}.{_b64encode(mac)}"
+
+def verify_ticket(token: str, keys: dict, now=None) -> dict:
+    """Check signature and expiry without any database access; returns the claims or raises InvalidTicket."""
+    try:
+        version, kid, body, mac = token.split(".")
+    except (AttributeError, ValueError):
+        raise InvalidTicket("Malformed ticket")
+    if version != TOKEN_VERSION:
+        raise InvalidTicket(f"Unsupported ticket version: {version}")
+    key = keys.get(kid)
+    if key is None:
+        raise InvalidTicket(f"Unknown signing key: {kid}")
+    try:
+        # A corrupted scan can contain any character; tokens we issue are pure ASCII
+        expected = hmac.new(key, f"{version}.{kid}.{body}".encode("ascii"), hashlib.sha256).digest()
+        given = _b64decode(mac)
+    except Exception:
+        raise InvalidTicket("Malformed ticket")
+    if not hmac.compare_digest(expected, given):
+        raise InvalidTicket("Bad signature")
+    try:
+        claims = json.loads(_b64decode(body))
+    except Exception:
+        raise InvalidTicket("Malformed payload")
+    if not isinstance(claims, dict) or not REQUIRED_CLAIMS.issubset(claims):
+        raise InvalidTicket("Malformed payload")
+    if claims.get("exp") is not None and (now if now is not None else time.time()) > claims["exp"]:
+        raise InvalidTicket("Ticket expired")
+    return claims
+
+def benchmark(n=200000):
+    keys = {"k1": b"bench-secret"}
+    token = sign_ticket(ticket_claims({
+        "id": 1, "booking_ref": "BK-0123456789", "booking_date": datetime.date.today(),
+        "time_slot": "06:00 AM - 08:00 AM", "persons": 4, "paid": True,
+    }), keys, "k1")
+    start = time.perf_counter()
+    for _ in range(n):
+        verify_ticket(token, keys)
+    elapsed = time.perf_counter() - start
+    print(f"token length: {len(token)} chars")
+    print(f"verified {n} tickets in {elapsed:.2f}s -> {n / elapsed:,.0f} verifications/sec (single thread)")
+
+if __name__ == "__main__":
+    benchmark()
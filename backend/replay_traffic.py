@@ -0,0 +1,227 @@
+# replay_traffic.py - replay captured production traffic and compare two builds
+#
+#   python replay_traffic.py run --capture capture-*.jsonl.gz --url http://127.0.0.1:5000 \
+#       --speed 1 --seed-bookings 50 --out before.json
+#   ... deploy the other build, run again with --out after.json ...
+#   python replay_traffic.py compare before.json after.json
+#
+# Requests are issued on the captured schedule divided by --speed (0 = as fast as possible).
+# Scrubbed values ("~d:10", "~s:7", "~e", see traffic_capture.py) are filled with synthetic
+# values derived from the request index, and captured booking ids are mapped onto bookings the
+# seeding phase creates, so two runs against equally seeded databases send identical traffic.
+# Each request is sent with the X-Temple-Id it was captured under, and bookings are seeded for
+# every temple in the trace, so multi-temple traffic hits the same temples and shards.
+# Run it against a local dev database only: /book and /payment are replayed as writes.
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from traffic_capture import read_capture
+
+RULE_PARAM = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+ID_KEYS = {"booking_id", "booking_ids"}
+
+def request_json(method, url, body=None, headers=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json", **(headers or {})})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except urllib.error.URLError:
+        return 0, b""
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def synth(marker, seed):
+    """Deterministic stand-in for a scrubbed value."""
+    digest = hashlib.sha256(seed.encode()).hexdigest()
+    if marker == "~e":
+        return f"replay{digest[:8]}@example.com"
+    kind, _, length = marker.partition(":")
+    length = int(length or 8)
+    if kind == "~d":
+        digits = "".join(str(int(c, 16) % 10) for c in (digest * (length // 64 + 1)))
+        return ("9" + digits)[:length]
+    return ("r" + digest * (length // 64 + 1))[:length]
+
+def fill(value, seed, booking_ids, key=None):
+    if isinstance(value, dict):
+        return {k: fill(v, f"{seed}.{k}", booking_ids, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [fill(v, f"{seed}.{i}", booking_ids, key) for i, v in enumerate(value)]
+    if key == "path" and isinstance(value, str):
+        # /batch sub-request paths carry markers in their segments and query values
+        route, _, query = value.partition("?")
+        route = "/".join(synth(seg, f"{seed}.{i}") if seg.startswith("~") else seg
+                         for i, seg in enumerate(route.split("/")))
+        if not query:
+            return route
+        pairs = [(k, synth(v, f"{seed}.{k}") if v.startswith("~") else v)
+                 for k, v in urllib.parse.parse_qsl(query, keep_blank_values=True)]
+        return route + "?" + urllib.parse.urlencode(pairs)
+    if key in ID_KEYS and isinstance(value, int) and booking_ids:
+        return booking_ids[value % len(booking_ids)]
+    if isinstance(value, str) and value.startswith("~"):
+        return synth(value, seed)
+    return value
+
+def entry_temple(entry):
+    return entry[8] if len(entry) > 8 else None
+
+def build_request(index, entry, booking_ids):
+    """Return (method, path, body, headers); entries from version 2 captures carry the temple."""
+    _, method, rule, view_args, query, body = entry[:6]
+    temple_id = entry_temple(entry)
+    headers = {"X-Temple-Id": temple_id} if temple_id else {}
+    booking_ids = booking_ids.get(temple_id, [])
+    seed = f"{index}"
+    view_args = fill(view_args, seed + ".v", booking_ids)
+    path = RULE_PARAM.sub(lambda m: urllib.parse.quote(str(view_args.get(m.group(1), "")), safe=""), rule)
+    query = fill(query, seed + ".q", booking_ids)
+    if query:
+        path += "?" + urllib.parse.urlencode(query, doseq=True)
+    return method, path, fill(body, seed + ".b", booking_ids), headers
+
+SEED_SLOTS = ["06:00 AM - 08:00 AM", "08:00 AM - 10:00 AM", "10:00 AM - 12:00 PM", "04:00 PM - 06:00 PM"]
+
+def seed_bookings(url, count, temple_id=None):
+    """
+    Create `count` bookings (half of them paid) for captured booking ids to map onto. They are
+    spread over dates and slots so /book admission control (per date+slot burst) does not
+    throttle the seeding; a 429 is still honoured by waiting Retry-After with the queue ticket.
+    """
+    ids = []
+    headers = {"X-Temple-Id": temple_id} if temple_id else None
+    base = datetime.date(2030, 1, 1)
+    for n in range(count):
+        body = {
+            "title": "Replay seed darshan",
+            "date": (base + datetime.timedelta(days=n // len(SEED_SLOTS))).isoformat(),
+            "time_slot": SEED_SLOTS[n % len(SEED_SLOTS)],
+            "persons": 2,
+            "person_details": [{"name": f"Replay {n}", "phone": "9000000000", "gender": "Other", "age": "30"}] * 2,
+        }
+        for _ in range(20):
+            status, raw = request_json("POST", url + "/book", body, headers)
+            if status != 429:
+                break
+            queued = json.loads(raw or b"{}")
+            body["queue_ticket"] = queued.get("queue_ticket")
+            time.sleep(queued.get("retry_after", 1))
+        if status != 201:
+            raise SystemExit(f"Seeding failed with HTTP {status}: {raw[:200]!r}")
+        booking_id = json.loads(raw)["booking_id"]
+        if n % 2 == 0:
+            request_json("POST", url + "/payment", {"booking_id": booking_id, "amount": 200, "payment_ref": f"REPLAY-{n}"}, headers)
+        ids.append(booking_id)
+    return ids
+
+def run(args):
+    paths = sorted({p for pattern in args.capture for p in glob.glob(pattern)})
+    if not paths:
+        raise SystemExit("No capture files matched")
+    trace = read_capture(paths)
+    if args.limit:
+        trace = trace[:args.limit]
+    booking_ids = {}
+    if args.seed_bookings:
+        for temple_id in sorted({entry_temple(entry) for _, entry in trace}, key=str):
+            booking_ids[temple_id] = seed_bookings(args.url, args.seed_bookings, temple_id)
+    print(f"replaying {len(trace)} requests from {len(paths)} file(s) at speed {args.speed or 'max'}")
+
+    results = {}
+    lock = threading.Lock()
+
+    def issue(index, entry):
+        method, path, body, headers = build_request(index, entry, booking_ids)
+        t0 = time.perf_counter()
+        status, _ = request_json(method, args.url + path, body, headers)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        route = f"{method} {entry[2]}"
+        with lock:
+            r = results.setdefault(route, {"latencies_ms": [], "statuses": {}, "captured_ms": []})
+            r["latencies_ms"].append(round(elapsed_ms, 2))
+            r["captured_ms"].append(entry[7])
+            r["statuses"][str(status)] = r["statuses"].get(str(status), 0) + 1
+
+    first = trace[0][0] if trace else 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        for index, (ts, entry) in enumerate(trace):
+            if args.speed > 0:
+                delay = (ts - first) / args.speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            ex.submit(issue, index, entry)
+    wall = time.monotonic() - start
+
+    summary = {}
+    for route, r in sorted(results.items()):
+        lat = r["latencies_ms"]
+        summary[route] = {
+            "count": len(lat),
+            "p50_ms": percentile(lat, 50),
+            "p95_ms": percentile(lat, 95),
+            "p99_ms": percentile(lat, 99),
+            "mean_ms": round(sum(lat) / len(lat), 2),
+            "captured_p50_ms": percentile(r["captured_ms"], 50),
+            "statuses": r["statuses"],
+        }
+        print(f"{route:45s} n={len(lat):6d}  p50={summary[route]['p50_ms']:8.1f}ms  p95={summary[route]['p95_ms']:8.1f}ms  {r['statuses']}")
+    print(f"wall time {wall:.1f}s, {len(trace) / wall if wall else 0:.0f} req/s")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"url": args.url, "speed": args.speed, "requests": len(trace), "wall_s": round(wall, 2), "routes": summary}, f, indent=2)
+
+def compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)["routes"]
+    with open(args.candidate) as f:
+        cand = json.load(f)["routes"]
+    print(f"{'route':45s} {'n':>6s} {'p50 base':>9s} {'p50 new':>9s} {'Δp50':>8s} {'p95 base':>9s} {'p95 new':>9s} {'Δp95':>8s}")
+    for route in sorted(set(base) | set(cand)):
+        b, c = base.get(route), cand.get(route)
+        if not b or not c:
+            print(f"{route:45s} only in {'candidate' if c else 'baseline'}")
+            continue
+
+        def delta(key):
+            return f"{(c[key] - b[key]) / b[key] * 100:+7.1f}%" if b[key] else "    n/a"
+
+        print(f"{route:45s} {c['count']:6d} {b['p50_ms']:8.1f}ms {c['p50_ms']:8.1f}ms {delta('p50_ms')} "
+              f"{b['p95_ms']:8.1f}ms {c['p95_ms']:8.1f}ms {delta('p95_ms')}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="Replay captured traffic against one build")
+    p_run.add_argument("--capture", nargs="+", required=True, help="Capture files or glob patterns")
+    p_run.add_argument("--url", default="http://127.0.0.1:5000")
+    p_run.add_argument("--speed", type=float, default=1.0, help="Time scale; 2 = twice as fast, 0 = no delays")
+    p_run.add_argument("--concurrency", type=int, default=32)
+    p_run.add_argument("--seed-bookings", type=int, default=50, help="Bookings to create per temple in the trace")
+    p_run.add_argument("--limit", type=int, default=None, help="Replay only the first N requests")
+    p_run.add_argument("--out", help="Write per-route latency summary to this JSON file")
+    p_cmp = sub.add_parser("compare", help="Per-route latency deltas between two run outputs")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("candidate")
+    args = parser.parse_args()
+    run(args) if args.command == "run" else compare(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Shared setup for the backend tests. Run from backend/:  python -m pytest tests
+#
+# app.py reads its configuration when it is imported, so the test shard layout is set here
+# first: the "default" shard is DB_NAME and a second "north" shard is TEST_DB_NAME_NORTH on
+# the same server, with temple "kedarnath-test" routed to it. Tests that need MySQL create
+# both schemas and skip when the server is not reachable; everything else runs without it.
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("DB_NAME", "divya_drishti_test")
+os.environ.setdefault("DB_CONNECT_TIMEOUT", "1")
+os.environ.setdefault("TEMPLE_SHARDS", json.dumps({
+    "shards": {"north": {"database": os.environ.get("TEST_DB_NAME_NORTH", "divya_drishti_test_north")}},
+    "temples": {"kedarnath-test": "north"},
+}))
+os.environ.pop("TRAFFIC_CAPTURE_FILE", None)
+os.environ.pop("USER_CACHE_REDIS_URL", None)
+
+@pytest.fixture
+def app_module():
+    """The Flask app module; skips when Flask or mysql-connector are not installed."""
+    pytest.importorskip("flask")
+    pytest.importorskip("mysql.connector")
+    import app
+    return app
+
+class FakeClock:
+    """Stand-in for time.monotonic that only moves when told to."""
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr("time.monotonic", fake)
+    return fake
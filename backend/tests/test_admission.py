@@ -0,0 +1,72 @@
+import pytest
+
+def test_token_bucket_refills_up_to_capacity(app_module, clock):
+    bucket = app_module.TokenBucket(rate=2.0, capacity=5)
+    bucket.tokens = 0
+    clock.advance(1.5)
+    bucket.refill(clock())
+    assert bucket.tokens == pytest.approx(3.0)
+    clock.advance(60)
+    bucket.refill(clock())
+    assert bucket.tokens == 5
+
+def test_slot_queue_positions_follow_issue_order(app_module):
+    queue = app_module.SlotQueue()
+    for ticket in (10, 11, 12, 13):
+        queue.add(ticket, deadline=100)
+    assert [queue.position(t) for t in (10, 11, 12, 13)] == [1, 2, 3, 4]
+    queue.remove(12)
+    assert len(queue) == 3 and queue.position(13) == 3
+    queue.remove(10)
+    queue.remove(11)
+    assert queue.position(13) == 1
+    assert queue.head == 3 and queue._gone == []
+
+def test_slot_queue_expires_only_stale_deadlines(app_module):
+    queue = app_module.SlotQueue()
+    queue.add(1, deadline=10)
+    queue.add(2, deadline=10)
+    queue.touch(1, deadline=50)
+    assert queue.expire(now=20) == 1
+    assert 1 in queue and 2 not in queue
+    assert queue.position(1) == 1
+
+def test_burst_is_admitted_then_requests_queue(app_module, clock):
+    ctl = app_module.AdmissionController(rate=1.0, burst=2, ticket_ttl=30)
+    key = ("puri", "2030-01-14", "06:00 AM - 08:00 AM")
+    assert ctl.admit(key) == (True, None)
+    assert ctl.admit(key) == (True, None)
+    admitted, info = ctl.admit(key)
+    assert not admitted and info["position"] == 1 and info["retry_after"] == 1
+
+def test_queue_is_first_in_first_out(app_module, clock):
+    ctl = app_module.AdmissionController(rate=1.0, burst=1, ticket_ttl=30)
+    key = ("puri", "2030-01-14", "06:00 AM - 08:00 AM")
+    ctl.admit(key)
+    first = ctl.admit(key)[1]["ticket"]
+    second = ctl.admit(key)[1]["ticket"]
+    clock.advance(1)
+    # A newcomer and the second ticket cannot jump the first one
+    assert ctl.admit(key)[0] is False
+    assert ctl.admit(key, second)[0] is False
+    assert ctl.admit(key, first) == (True, None)
+    clock.advance(1)
+    assert ctl.admit(key, str(second)) == (True, None)
+
+def test_ticket_survives_its_retry_after_wait(app_module, clock):
+    ctl = app_module.AdmissionController(rate=0.1, burst=1, ticket_ttl=5)
+    key = ("puri", "2030-01-14", "06:00 AM - 08:00 AM")
+    ctl.admit(key)
+    _, info = ctl.admit(key)
+    clock.advance(info["retry_after"] + 4)
+    assert ctl.admit(key, info["ticket"]) == (True, None)
+
+def test_abandoned_ticket_expires_after_ttl(app_module, clock):
+    ctl = app_module.AdmissionController(rate=0.1, burst=1, ticket_ttl=5)
+    key = ("puri", "2030-01-14", "06:00 AM - 08:00 AM")
+    ctl.admit(key)
+    _, abandoned = ctl.admit(key)
+    clock.advance(abandoned["retry_after"] + 6)
+    admitted, _ = ctl.admit(key)
+    assert admitted
+    assert ctl.metrics()["expired_tickets"] == 1
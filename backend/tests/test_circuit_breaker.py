@@ -0,0 +1,90 @@
+import pytest
+
+@pytest.fixture
+def breaker(app_module, clock):
+    return app_module.CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+
+def test_opens_after_threshold_consecutive_failures(breaker):
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+def test_trip_opens_immediately(breaker):
+    breaker.record_failure(trip=True)
+    assert breaker.state == "open"
+
+def test_half_open_lets_exactly_one_probe_through(breaker, clock):
+    breaker.record_failure(trip=True)
+    clock.advance(10)
+    assert breaker.would_allow()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    assert not breaker.would_allow()
+
+def test_probe_result_closes_or_reopens(breaker, clock):
+    breaker.record_failure(trip=True)
+    clock.advance(10)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock.advance(10)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+def test_would_allow_does_not_claim_the_probe(breaker, clock):
+    breaker.record_failure(trip=True)
+    clock.advance(10)
+    for _ in range(3):
+        assert breaker.would_allow()
+    assert breaker.allow()
+
+def test_outage_errors_are_told_apart_from_query_errors(app_module):
+    Error = app_module.Error
+    assert app_module.is_outage_error(Error(errno=2013))
+    assert app_module.is_outage_error(Error(errno=3024))
+    assert not app_module.is_outage_error(Error(errno=1062))
+    wrapped = app_module.Error("Can not reconnect")
+    wrapped.__cause__ = Error(errno=2003)
+    assert app_module.is_outage_error(wrapped)
+
+class _Cursor:
+    def __init__(self, exc):
+        self.exc = exc
+        self.rowcount = 7
+
+    def execute(self, *args):
+        if self.exc:
+            raise self.exc
+
+class _Conn:
+    def __init__(self, exc=None):
+        self.exc = exc
+
+    def cursor(self, **kwargs):
+        return _Cursor(self.exc)
+
+def test_breaker_connection_records_only_outage_errors(app_module, breaker):
+    Error = app_module.Error
+    conn = app_module.BreakerConnection(_Conn(Error(errno=1062)), breaker)
+    cursor = conn.cursor()
+    with pytest.raises(Error):
+        cursor.execute("INSERT ...")
+    assert breaker.failures == 0
+    assert cursor.rowcount == 7
+
+    conn = app_module.BreakerConnection(_Conn(Error(errno=2013)), breaker)
+    with pytest.raises(Error):
+        conn.cursor().execute("SELECT 1")
+    assert breaker.failures == 1
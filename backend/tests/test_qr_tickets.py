@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+from qr_tickets import DEV_KEYS, InvalidTicket, load_keys_from_env, sign_ticket, ticket_claims, verify_ticket
+
+KEYS = {"k1": b"secret-one", "k2": b"secret-two"}
+
+def booking(**overrides):
+    row = {"id": 42, "booking_ref": "BK-0123456789", "booking_date": datetime.date(2030, 1, 14),
+           "time_slot": "06:00 AM - 08:00 AM", "persons": 3, "paid": True, "temple_id": "puri"}
+    row.update(overrides)
+    return row
+
+def issue_time():
+    return datetime.datetime(2030, 1, 14, 6, 0).timestamp()
+
+def test_round_trip_returns_claims():
+    token = sign_ticket(ticket_claims(booking()), KEYS, "k1")
+    claims = verify_ticket(token, KEYS, now=issue_time())
+    assert (claims["i"], claims["r"], claims["d"], claims["n"], claims["p"], claims["t"]) == \
+        (42, "BK-0123456789", "2030-01-14", 3, 1, "puri")
+
+def test_expires_at_end_of_darshan_day():
+    token = sign_ticket(ticket_claims(booking()), KEYS, "k1")
+    end_of_day = datetime.datetime(2030, 1, 15).timestamp()
+    verify_ticket(token, KEYS, now=end_of_day)
+    with pytest.raises(InvalidTicket, match="expired"):
+        verify_ticket(token, KEYS, now=end_of_day + 1)
+
+def test_rotated_key_still_verifies_until_removed():
+    token = sign_ticket(ticket_claims(booking()), KEYS, "k1")
+    verify_ticket(token, {"k1": KEYS["k1"]}, now=issue_time())
+    with pytest.raises(InvalidTicket, match="Unknown signing key"):
+        verify_ticket(token, {"k2": KEYS["k2"]}, now=issue_time())
+
+def test_tampered_payload_is_rejected():
+    token = sign_ticket(ticket_claims(booking(paid=False)), KEYS, "k1")
+    forged = sign_ticket(ticket_claims(booking(paid=True)), KEYS, "k1")
+    version, kid, _, mac = token.split(".")
+    with pytest.raises(InvalidTicket, match="Bad signature"):
+        verify_ticket(".".join([version, kid, forged.split(".")[2], mac]), KEYS, now=issue_time())
+
+@pytest.mark.parametrize("token", [
+    None, 12345, "", "v1.k1.abc", "v1.k1.é.mac", "v1.k1.abc.%%%", "v9.k1.abc.def",
+])
+def test_malformed_tokens_raise_invalid_ticket(token):
+    with pytest.raises(InvalidTicket):
+        verify_ticket(token, KEYS, now=issue_time())
+
+def test_missing_required_claims_are_rejected():
+    claims = ticket_claims(booking())
+    del claims["i"]
+    with pytest.raises(InvalidTicket, match="Malformed payload"):
+        verify_ticket(sign_ticket(claims, KEYS, "k1"), KEYS, now=issue_time())
+
+def test_no_keys_configured_disables_tickets(monkeypatch):
+    monkeypatch.delenv("QR_SIGNING_KEYS", raising=False)
+    monkeypatch.delenv("QR_ALLOW_DEV_KEY", raising=False)
+    assert load_keys_from_env() == ({}, None)
+
+def test_dev_key_needs_explicit_opt_in(monkeypatch):
+    monkeypatch.delenv("QR_SIGNING_KEYS", raising=False)
+    monkeypatch.setenv("QR_ALLOW_DEV_KEY", "1")
+    assert load_keys_from_env() == (DEV_KEYS, "dev")
+
+def test_keys_and_active_kid_from_env(monkeypatch):
+    monkeypatch.setenv("QR_SIGNING_KEYS", "old:aaa, new:bbb")
+    monkeypatch.setenv("QR_ACTIVE_KID", "new")
+    assert load_keys_from_env() == ({"old": b"aaa", "new": b"bbb"}, "new")
+    monkeypatch.setenv("QR_ACTIVE_KID", "missing")
+    with pytest.raises(ValueError):
+        load_keys_from_env()
@@ -0,0 +1,127 @@
+import datetime
+import json
+
+import pytest
+
+def test_configured_temples_route_to_their_shard(app_module):
+    assert set(app_module.db_shards) == {"default", "north"}
+    assert app_module.shard_for_temple("kedarnath-test") == "north"
+    assert app_module.shard_for_temple("anything-else") == "default"
+    assert app_module.db_config("north")["database"] != app_module.db_config("default")["database"]
+
+def test_unknown_shard_in_config_is_rejected(app_module, monkeypatch):
+    monkeypatch.setenv("TEMPLE_SHARDS", json.dumps({"temples": {"puri": "nowhere"}}))
+    with pytest.raises(ValueError, match="unknown shard"):
+        app_module.load_shard_config()
+
+def test_temple_comes_from_header_then_query_then_body(app_module):
+    app = app_module.app
+    with app.test_request_context("/?temple_id=q", headers={"X-Temple-Id": "h"}, json={"temple_id": "b"}):
+        assert app_module.current_temple_id() == "h"
+    with app.test_request_context("/?temple_id=q", json={"temple_id": "b"}):
+        assert app_module.current_temple_id() == "q"
+    with app.test_request_context("/", method="POST", json={"temple_id": "b"}):
+        assert app_module.current_temple_id() == "b"
+    with app.test_request_context("/"):
+        assert app_module.current_temple_id() == app_module.DEFAULT_TEMPLE_ID
+
+class _FakeConn:
+    def __init__(self, shard):
+        self.shard = shard
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_fan_out_runs_every_shard_and_reports_failures(app_module, monkeypatch):
+    conns = {}
+
+    def fake_connection(shard=None):
+        conns[shard] = _FakeConn(shard)
+        return conns[shard]
+
+    def per_shard(shard, conn):
+        if shard == "north":
+            raise RuntimeError("north is down")
+        return f"rows from {conn.shard}"
+
+    monkeypatch.setattr(app_module, "get_db_connection", fake_connection)
+    results, errors = app_module.fan_out_shards(per_shard)
+    assert results == {"default": "rows from default"}
+    assert errors == {"north": "north is down"}
+    assert all(c.closed for c in conns.values())
+
+# ---------- two local schemas (needs a MySQL server; skipped otherwise) ----------
+TEMPLES = {"puri-test": "default", "kedarnath-test": "north"}
+
+@pytest.fixture(scope="module")
+def mysql_shards():
+    pytest.importorskip("flask")
+    mysql = pytest.importorskip("mysql.connector")
+    import app as app_module
+
+    cfg = app_module.db_config("default")
+    try:
+        server = mysql.connect(host=cfg["host"], user=cfg["user"], password=cfg["password"], port=cfg["port"],
+                               connection_timeout=cfg["connection_timeout"])
+    except mysql.Error as e:
+        pytest.skip(f"MySQL not reachable: {e}")
+    cursor = server.cursor()
+    for shard in app_module.db_shards:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{app_module.db_config(shard)['database']}`")
+    for shard in app_module.db_shards:
+        app_module.create_tables(shard)
+
+    def clear():
+        for temple, shard in TEMPLES.items():
+            conn = app_module.get_db_connection(shard)
+            c = conn.cursor()
+            c.execute("DELETE p FROM persons p JOIN bookings b ON b.id = p.booking_id WHERE b.temple_id = %s", (temple,))
+            c.execute("DELETE FROM notifications WHERE temple_id = %s", (temple,))
+            c.execute("DELETE FROM bookings WHERE temple_id = %s", (temple,))
+            conn.commit()
+            c.close()
+            conn.close()
+
+    clear()
+    yield app_module
+    clear()
+    cursor.close()
+    server.close()
+
+def _book(client, temple, booking_date):
+    resp = client.post("/book", headers={"X-Temple-Id": temple}, json={
+        "title": "Test darshan", "date": booking_date, "time_slot": "06:00 AM - 08:00 AM", "persons": 1,
+        "person_details": [{"name": "Test", "phone": "9000000000", "gender": "Other", "age": "30"}],
+    })
+    assert resp.status_code == 201, resp.get_json()
+    return resp.get_json()["booking_id"]
+
+def _temples_in_schema(app_module, shard):
+    conn = app_module.get_db_connection(shard)
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT temple_id FROM bookings WHERE temple_id IN (%s, %s)", tuple(TEMPLES))
+    found = {r[0] for r in c.fetchall()}
+    c.close()
+    conn.close()
+    return found
+
+def test_bookings_land_in_their_temples_schema_and_admin_summary_merges_them(mysql_shards):
+    app_module = mysql_shards
+    client = app_module.app.test_client()
+    booking_date = (datetime.date.today() + datetime.timedelta(days=30)).isoformat()
+    puri_id = _book(client, "puri-test", booking_date)
+    _book(client, "kedarnath-test", booking_date)
+
+    assert _temples_in_schema(app_module, "default") == {"puri-test"}
+    assert _temples_in_schema(app_module, "north") == {"kedarnath-test"}
+
+    # A temple cannot read another temple's booking, even by id
+    assert client.get(f"/booking/{puri_id}", headers={"X-Temple-Id": "puri-test"}).status_code == 200
+    assert client.get(f"/booking/{puri_id}", headers={"X-Temple-Id": "kedarnath-test"}).status_code == 404
+
+    summary = client.get(f"/admin/temples/summary?date={booking_date}").get_json()
+    assert summary["errors"] == {}
+    by_temple = {t["temple_id"]: t for t in summary["temples"]}
+    assert by_temple["puri-test"]["shard"] == "default" and by_temple["puri-test"]["bookings"] == 1
+    assert by_temple["kedarnath-test"]["shard"] == "north" and by_temple["kedarnath-test"]["bookings"] == 1
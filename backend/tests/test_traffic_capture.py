@@ -0,0 +1,47 @@
+import gzip
+import json
+
+from replay_traffic import build_request, fill
+from traffic_capture import TrafficRecorder, read_capture, scrub_path, scrub_value
+
+def test_safe_keys_are_kept_and_everything_else_becomes_a_shape_marker():
+    body = {"date": "2030-01-14", "persons": 2, "phone": "9876543210", "name": "Lakshmi",
+            "email": "devotee@example.com", "otp": 123456, "card": 4111111111111111,
+            "person_details": [{"name": "Ravi", "age": "30", "gender": "Male"}]}
+    assert scrub_value(body) == {
+        "date": "2030-01-14", "persons": 2, "phone": "~d:10", "name": "~s:7", "email": "~e",
+        "otp": 123456, "card": "~d:16",
+        "person_details": [{"name": "~s:4", "age": "30", "gender": "Male"}],
+    }
+
+def test_none_and_booleans_pass_through():
+    assert scrub_value({"phone": None, "flag": True}) == {"phone": None, "flag": True}
+
+def test_batch_paths_keep_routes_but_not_identifiers():
+    assert scrub_path("/profile/9876543210") == "/profile/~d:10"
+    assert scrub_path("/booking/12/qr") == "/booking/12/qr"
+    assert scrub_path("/history/user?phone=9876543210") == "/history/user?phone=~d:10"
+    assert scrub_value({"requests": [{"path": "/admin/users/search?q=Ravi&limit=20"}]}) == \
+        {"requests": [{"path": "/admin/users/search?q=~s:4&limit=20"}]}
+
+def test_replay_fills_markers_deterministically():
+    scrubbed = scrub_value({"phone": "9876543210", "requests": [{"path": "/profile/9876543210"}]})
+    first, second = fill(scrubbed, "7", []), fill(scrubbed, "7", [])
+    assert first == second
+    assert len(first["phone"]) == 10 and first["phone"].isdigit()
+    assert first["requests"][0]["path"].startswith("/profile/") and "~" not in first["requests"][0]["path"]
+
+def test_recorded_entries_replay_with_their_temple(tmp_path):
+    path = str(tmp_path / "capture-{pid}.jsonl.gz")
+    recorder = TrafficRecorder(path, sample_rate=1.0)
+    recorder.record("GET", "/booking/<int:booking_id>", {"booking_id": 17}, {}, None, 200, 3.2, "puri")
+    recorder.record("GET", "/profile/<phone>", {"phone": "9876543210"}, {}, None, 200, 1.0, None)
+    recorder.close()
+    with gzip.open(recorder.path, "rt") as f:
+        assert json.loads(f.readline())["v"] == 2
+
+    (_, booking_entry), (_, profile_entry) = read_capture([recorder.path])
+    assert build_request(0, booking_entry, {"puri": [501, 502]}) == \
+        ("GET", "/booking/502", None, {"X-Temple-Id": "puri"})
+    method, path, _, headers = build_request(1, profile_entry, {})
+    assert method == "GET" and path.startswith("/profile/9") and headers == {}
@@ -0,0 +1,49 @@
+import pytest
+
+PROFILE = {"id": 1, "user_ref": "USR-1", "phone": "9876543210", "name": "Ravi", "dob": "1990-01-01",
+           "gender": "Male", "address": "Puri", "created_at": "2030-01-01T00:00:00", "password": "hash"}
+
+@pytest.fixture
+def cache(app_module):
+    return app_module.UserCache(max_entries=2, ttl_seconds=60)
+
+def test_put_then_get_returns_public_fields_only(cache):
+    cache.put("9876543210", PROFILE, cache.read_token("9876543210"))
+    cached = cache.get("9876543210")
+    assert cached["name"] == "Ravi" and "password" not in cached
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.put("9876543210", PROFILE, cache.read_token("9876543210"))
+    clock.advance(61)
+    assert cache.get("9876543210") is None
+
+def test_lru_eviction(cache):
+    for phone in ("1", "2", "3"):
+        cache.put(phone, PROFILE, cache.read_token(phone))
+    assert cache.get("1") is None and cache.get("3") is not None
+    assert cache.metrics()["evictions"] == 1
+
+def test_read_that_races_an_invalidation_is_not_cached(cache):
+    token = cache.read_token("9876543210")      # read-through starts its SELECT
+    cache.invalidate("9876543210")              # PUT /profile commits meanwhile
+    cache.put("9876543210", PROFILE, token)     # the old row must not be cached
+    assert cache.get("9876543210") is None
+
+def test_read_started_after_invalidation_is_cached(cache):
+    cache.invalidate("9876543210")
+    cache.put("9876543210", PROFILE, cache.read_token("9876543210"))
+    assert cache.get("9876543210") is not None
+
+def test_invalidating_another_user_does_not_block_puts(cache):
+    token = cache.read_token("9876543210")
+    cache.invalidate("1111111111")
+    cache.put("9876543210", PROFILE, token)
+    assert cache.get("9876543210") is not None
+
+def test_forgotten_invalidations_raise_the_token_floor(cache):
+    token = cache.read_token("9876543210")
+    cache.invalidate("9876543210")
+    for phone in ("1", "2"):
+        cache.invalidate(phone)   # pushes 9876543210 out of the bounded generation map
+    cache.put("9876543210", PROFILE, token)
+    assert cache.get("9876543210") is None
@@ -0,0 +1,160 @@
+# traffic_capture.py - opt-in sampling of production requests for replay benchmarks
+#
+# Enabled from app.py when TRAFFIC_CAPTURE_FILE is set, e.g.
+#   TRAFFIC_CAPTURE_FILE=/var/log/dd/capture-{pid}.jsonl.gz TRAFFIC_CAPTURE_SAMPLE=0.05
+# {pid} keeps worker processes from sharing a file. replay_traffic.py re-issues the traces.
+#
+# File format: gzip'd JSON lines. Line 1 is a header {"v": 2, "started": <epoch seconds>};
+# every other line is one request:
+#   [offset_ms, method, url_rule, view_args, query, body, status, duration_ms, temple_id]
+# temple_id is the temple the app resolved for the request (X-Temple-Id, ?temple_id= or the
+# body), so replay can route multi-temple traffic to the same temples and shards. Version 1
+# files have no temple_id and replay against the default temple.
+# Values are scrubbed before they are written: strings under keys outside SAFE_KEYS become
+# shape markers ("~d:10" for ten digits, "~s:7" for seven other characters, "~e" for an
+# email) so a trace keeps the request shape and sizes but no names, phones, OTPs or tokens.
+# "path" values (the sub-requests of a /batch body) keep their route words and short numeric
+# ids, while long digit runs, emails and every query-string value are scrubbed the same way.
+# Requests whose WSGI environ has SKIP_ENVIRON_KEY set (/batch sub-requests) are not recorded.
+import atexit
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+CAPTURE_VERSION = 2
+SAFE_KEYS = {
+    "date", "start", "days", "limit", "time_slot", "temple_id", "title", "type", "persons", "amount",
+    "age", "gender", "wheelchair_required", "is_elder_disabled", "booking_id", "booking_ids",
+    "notification_id", "gate_id", "device_id", "method", "horizon_days", "include_archive",
+}
+SKIP_PREFIXES = ("/dev/",)
+SKIP_ENVIRON_KEY = "traffic_capture.skip"
+
+def scrub_segment(segment):
+    if "@" in segment:
+        return "~e"
+    if segment.isdigit() and len(segment) > 6:
+        return f"~d:{len(segment)}"
+    return segment
+
+def scrub_path(path):
+    """Scrub a request path string: identifying segments and all query values."""
+    route, _, query = path.partition("?")
+    route = "/".join(scrub_segment(seg) for seg in route.split("/"))
+    if not query:
+        return route
+    pairs = [(k, scrub_value(v, k)) for k, v in urllib.parse.parse_qsl(query, keep_blank_values=True)]
+    return route + "?" + "&".join(f"{urllib.parse.quote(k)}={urllib.parse.quote(str(v), safe='~:')}" for k, v in pairs)
+
+def scrub_value(value, key=None):
+    """Replace anything that could identify a devotee with a shape marker."""
+    if isinstance(value, dict):
+        return {k: scrub_value(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [scrub_value(v, key) for v in value]
+    if value is None or isinstance(value, bool):
+        return value
+    if key == "path" and isinstance(value, str):
+        return scrub_path(value)
+    if key in SAFE_KEYS:
+        return value
+    if isinstance(value, (int, float)):
+        return value if abs(value) < 10 ** 6 else f"~d:{len(str(abs(int(value))))}"
+    text = str(value)
+    if "@" in text:
+        return "~e"
+    if text.isdigit():
+        return f"~d:{len(text)}"
+    return f"~s:{len(text)}"
+
+class TrafficRecorder:
+    """Thread-safe sampled writer for the capture file; flushes every flush_every records and at exit."""
+    def __init__(self, path, sample_rate=0.1, flush_every=100):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.sample_rate = sample_rate
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._pending = 0
+        self.recorded = 0
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._file.write(json.dumps({"v": CAPTURE_VERSION, "started": time.time()}) + "\n")
+        atexit.register(self.close)
+
+    def sampled(self):
+        return random.random() < self.sample_rate
+
+    def record(self, method, rule, view_args, query, body, status, duration_ms, temple_id=None):
+        entry = [
+            int((time.monotonic() - self._started) * 1000), method, rule,
+            scrub_value(view_args or {}), scrub_value(query or {}), scrub_value(body),
+            status, round(duration_ms, 2), temple_id,
+        ]
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self.recorded += 1
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+def install_capture(app, path, sample_rate=0.1, temple_id=None):
+    """
+    Hook a TrafficRecorder into a Flask app. Unmatched routes and /dev/ endpoints are never
+    recorded. temple_id is a callable returning the active request's temple.
+    """
+    from flask import g, request
+
+    recorder = TrafficRecorder(path, sample_rate)
+
+    @app.before_request
+    def _capture_start():
+        if request.environ.get(SKIP_ENVIRON_KEY):
+            return
+        if request.url_rule is not None and not request.path.startswith(SKIP_PREFIXES) and recorder.sampled():
+            g._capture_t0 = time.perf_counter()
+
+    @app.after_request
+    def _capture_finish(response):
+        # Sub-requests share the outer request's g, so they must not touch its timer
+        if request.environ.get(SKIP_ENVIRON_KEY):
+            return response
+        t0 = g.pop("_capture_t0", None)
+        if t0 is not None:
+            try:
+                body = request.get_json(silent=True) if request.is_json else None
+                query = {k: v if len(v) > 1 else v[0] for k, v in request.args.lists()}
+                recorder.record(request.method, request.url_rule.rule, request.view_args, query,
+                                body, response.status_code, (time.perf_counter() - t0) * 1000,
+                                temple_id() if temple_id else None)
+            except Exception as e:
+                print(f"⚠️ Traffic capture failed: {e}")
+        return response
+
+    print(f"🎥 Capturing {sample_rate:.0%} of requests to {recorder.path}")
+    return recorder
+
+def read_capture(paths):
+    """Merge capture files into one time-ordered list of (epoch_seconds, entry)."""
+    merged = []
+    for path in paths:
+        started = None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if isinstance(row, dict):
+                    started = row["started"]  # appended runs each start with a fresh header
+                    continue
+                merged.append((started + row[0] / 1000.0, row))
+    merged.sort(key=lambda item: item[0])
+    return merged
@@ -1,3 +1,5 @@
+import 'dart:async';
+
 import 'package:divya_drishti/admin/models/user_model.dart';
 import 'package:divya_drishti/admin/services/api_service.dart';
 import 'package:divya_drishti/admin/widgets/user_card.dart';
@@ -15,7 +17,12 @@ class _UsersManagementScreenState extends State<UsersManagementScreen> {
   List<User> _users = [];
   List<User> _filteredUsers = [];
   bool _isLoading = false;
+  bool _isLoadingMore = false;
   String _searchQuery = '';
+  String? _nextCursor;
+  Timer? _searchDebounce;
+  // Bumped by every new search; responses tagged with an older value are dropped
+  int _searchSeq = 0;
 
   @override
   void initState() {
@@ -23,38 +30,74 @@ class _UsersManagementScreenState extends State<UsersManagementScreen> {
     _loadUsers();
   }
 
+  @override
+  void dispose() {
+    _searchDebounce?.cancel();
+    super.dispose();
+  }
+
   Future<void> _loadUsers() async {
+    final seq = ++_searchSeq;
     setState(() {
       _isLoading = true;
     });
 
     try {
-      final users = await ApiService.getAllUsers();
+      final page = await ApiService.searchUsers(query: _searchQuery);
+      if (!mounted || seq != _searchSeq) return;
       setState(() {
-        _users = users;
-        _filteredUsers = users;
+        _users = page['users'] as List<User>;
+        _filteredUsers = _users;
+        _nextCursor = page['next_cursor'] as String?;
       });
     } catch (e) {
+      if (!mounted || seq != _searchSeq) return;
       _showError('Failed to load users: $e');
     } finally {
-      setState(() {
-        _isLoading = false;
-      });
+      if (mounted && seq == _searchSeq) {
+        setState(() {
+          _isLoading = false;
+        });
+      }
     }
   }
 
-  void _filterUsers(String query) {
+  Future<void> _loadMoreUsers() async {
+    if (_nextCursor == null || _isLoadingMore) return;
+    final seq = _searchSeq;
     setState(() {
-      _searchQuery = query;
-      if (query.isEmpty) {
+      _isLoadingMore = true;
+    });
+
+    try {
+      final page = await ApiService.searchUsers(
+          query: _searchQuery, cursor: _nextCursor);
+      // A new search started meanwhile: this page belongs to the old results
+      if (!mounted || seq != _searchSeq) return;
+      setState(() {
+        _users.addAll(page['users'] as List<User>);
         _filteredUsers = _users;
-      } else {
-        _filteredUsers = _users.where((user) {
-          return user.phone.contains(query) ||
-              user.name.toLowerCase().contains(query.toLowerCase()) ||
-              user.userRef.toLowerCase().contains(query.toLowerCase());
-        }).toList();
+        _nextCursor = page['next_cursor'] as String?;
+      });
+    } catch (e) {
+      if (mounted && seq == _searchSeq) {
+        _showError('Failed to load more users: $e');
+      }
+    } finally {
+      if (mounted) {
+        setState(() {
+          _isLoadingMore = false;
+        });
       }
+    }
+  }
+
+  void _filterUsers(String query) {
+    // Search runs on the server; wait for typing to pause before querying
+    _searchDebounce?.cancel();
+    _searchDebounce = Timer(const Duration(milliseconds: 300), () {
+      _searchQuery = query.trim();
+      _loadUsers();
     });
   }
 
@@ -83,7 +126,7 @@ class _UsersManagementScreenState extends State<UsersManagementScreen> {
         // await ApiService.deleteUser(user.id);
         setState(() {
           _users.removeWhere((u) => u.id == user.id);
-          _filterUsers(_searchQuery);
+          _filteredUsers = _users;
         });
         _showSuccess('User deleted successfully');
       } catch (e) {
@@ -219,14 +262,17 @@ class _UsersManagementScreenState extends State<UsersManagementScreen> {
                   avatar: CircleAvatar(
                     backgroundColor: Colors.blue,
                     child: Text(
-                      _filteredUsers.length.toString(),
+                      // Pages are loaded on demand, so this counts loaded rows, not all users
+                      _nextCursor != null
+                          ? '${_filteredUsers.length}+'
+                          : _filteredUsers.length.toString(),
                       style: const TextStyle(
                         fontSize: 12,
                         color: Colors.white,
                       ),
                     ),
                   ),
-                  label: const Text('Total Users'),
+                  label: const Text('Loaded'),
                 ),
                 const SizedBox(width: 8),
                 Chip(
@@ -275,8 +321,22 @@ class _UsersManagementScreenState extends State<UsersManagementScreen> {
                         onRefresh: _loadUsers,
                         child: ListView.builder(
                           padding: const EdgeInsets.only(bottom: 80),
-                          itemCount: _filteredUsers.length,
+                          itemCount: _filteredUsers.length +
+                              (_nextCursor != null ? 1 : 0),
                           itemBuilder: (context, index) {
+                            if (index == _filteredUsers.length) {
+                              return Padding(
+                                padding: const EdgeInsets.all(16.0),
+                                child: Center(
+                                  child: _isLoadingMore
+                                      ? const CircularProgressIndicator()
+                                      : TextButton(
+                                          onPressed: _loadMoreUsers,
+                                          child: const Text('Load more'),
+                                        ),
+                                ),
+                              );
+                            }
                             final user = _filteredUsers[index];
                             return UserCard(
                               user: user,
@@ -73,6 +73,24 @@ class ApiService {
     return usersJson.map((json) => User.fromJson(json)).toList();
   }
 
+  // Search users server-side, one page at a time (keyset pagination)
+  static Future<Map<String, dynamic>> searchUsers({
+    String query = '',
+    String? cursor,
+    int limit = 50,
+  }) async {
+    final params = <String, String>{'limit': '$limit'};
+    if (query.isNotEmpty) params['q'] = query;
+    if (cursor != null) params['cursor'] = cursor;
+    final response = await _makeRequest(
+        '/admin/users/search?${Uri(queryParameters: params).query}', 'GET');
+    final List<dynamic> usersJson = response['users'];
+    return {
+      'users': usersJson.map((json) => User.fromJson(json)).toList(),
+      'next_cursor': response['next_cursor'],
+    };
+  }
+
   // Get all bookings
   static Future<List<Booking>> getAllBookings() async {
     final response = await _makeRequest('/history', 'GET');